@@ -1,8 +1,169 @@
+import logging
+import random
+import re
+import time
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
 from django.http import HttpRequest
 from django.utils.deprecation import MiddlewareMixin
 from django.views.defaults import permission_denied
 
-from backend.settings.base import ENV
+from backend.settings.base import (
+    DATABASE_READ_YOUR_WRITES_SECONDS,
+    ENV,
+    TRACING_ENABLED,
+    TRACING_SAMPLE_RATE,
+    TRACING_SERVER_TIMING,
+    TRACING_SLOW_REQUEST_MS,
+)
+from backend.settings.db_router import ReadRouting, current_routing, get_replica_aliases
+from backend.settings.logging import LoggerContext, RequestContext, current_request
+from backend.settings.tracing import (
+    TRACE_KINDS,
+    RequestTrace,
+    current_trace,
+    install_query_tracing,
+)
+
+log = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+# Request ids given by a proxy are only used when they look like one
+REQUEST_ID_PATTERN = re.compile(r'[A-Za-z0-9._-]{1,64}')
+
+
+class RequestIdMiddleware(MiddlewareMixin):
+    """
+        Sets the request being handled for logs. The id is the X-Request-ID
+        header of the request when there is one, e.g. set by the proxy, and
+        is returned in the same header.
+    """
+    def process_request(self, request: HttpRequest):
+        request_id = request.headers.get(REQUEST_ID_HEADER, '')
+        if not REQUEST_ID_PATTERN.fullmatch(request_id):
+            request_id = uuid.uuid4().hex
+        request.request_id = request_id
+        # Not reset in process_response so that the error logs django writes
+        # after the middlewares still have it. The next request replaces it.
+        current_request.set(RequestContext(request_id))
+
+    def process_response(self, request, response):
+        if hasattr(request, 'request_id'):
+            response.headers.setdefault(REQUEST_ID_HEADER, request.request_id)
+        return response
+
+
+def _get_server_timing(trace: RequestTrace, elapsed: float) -> str:
+    metrics = [
+        f'{kind};dur={trace.durations[kind] * 1000:.3f};desc="{trace.counts[kind]} calls"'
+        for kind in TRACE_KINDS
+        if trace.counts[kind]
+    ]
+    metrics.append(f'total;dur={elapsed * 1000:.3f}')
+    return ', '.join(metrics)
+
+
+class TracingMiddleware(MiddlewareMixin):
+    """
+        Traces 1 in TRACING_SAMPLE_RATE requests: the time spent in database
+        queries, cache calls and outbound http requests, see
+        backend.settings.tracing. Traced requests get a Server-Timing header
+        and a log line. Requests slower than TRACING_SLOW_REQUEST_MS are
+        logged as warnings whether they were traced or not, with their
+        queries when they were.
+    """
+    def __init__(self, get_response):
+        if not TRACING_ENABLED:
+            raise MiddlewareNotUsed()
+        super().__init__(get_response)
+        install_query_tracing()
+
+    def process_request(self, request: HttpRequest):
+        request._trace_started_at = time.perf_counter()
+        request._trace = RequestTrace() if random.random() * TRACING_SAMPLE_RATE < 1 else None
+        current_trace.set(request._trace)
+
+    def process_response(self, request, response):
+        started_at = getattr(request, '_trace_started_at', None)
+        if started_at is None:
+            return response
+
+        elapsed = time.perf_counter() - started_at
+        trace = request._trace
+        current_trace.set(None)
+        is_slow = elapsed * 1000 >= TRACING_SLOW_REQUEST_MS
+        if trace is None and not is_slow:
+            return response
+
+        context = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'traced': trace is not None,
+        }
+        if trace is not None:
+            for kind in TRACE_KINDS:
+                context[f'{kind}_count'] = trace.counts[kind]
+                context[f'{kind}_ms'] = round(trace.durations[kind] * 1000, 3)
+            if TRACING_SERVER_TIMING:
+                response.headers['Server-Timing'] = _get_server_timing(trace, elapsed)
+
+        if is_slow:
+            if trace is not None:
+                context['queries'] = trace.queries
+            log.warning('Slow request', extra=LoggerContext(type='SLOW_REQUEST', context=context, duration=elapsed))
+        else:
+            log.info('Request trace', extra=LoggerContext(type='REQUEST_TRACE', context=context, duration=elapsed))
+        return response
+
+
+# Unix time until which the reads of a browser go to the primary database
+READ_PRIMARY_COOKIE = 'read_primary_until'
+
+
+class ReadReplicaMiddleware(MiddlewareMixin):
+    """
+        Routes the reads of requests with backend.settings.db_router. A request
+        that is not safe or that wrote gets a cookie which sends the reads of
+        the next requests of the browser to the primary for
+        DATABASE_READ_YOUR_WRITES_SECONDS, so that they see the writes before
+        the replicas have them.
+    """
+    def __init__(self, get_response):
+        if not get_replica_aliases():
+            raise MiddlewareNotUsed()
+        super().__init__(get_response)
+
+    def process_request(self, request: HttpRequest):
+        now = time.time()
+        try:
+            primary_until = float(request.COOKIES.get(READ_PRIMARY_COOKIE, 0))
+        except ValueError:
+            primary_until = 0
+        # The cookie cannot ask for the primary for longer than configured
+        has_recently_written = now < primary_until <= now + DATABASE_READ_YOUR_WRITES_SECONDS
+        current_routing.set(ReadRouting(request.method not in SAFE_METHODS or has_recently_written))
+
+    def process_response(self, request, response):
+        routing = current_routing.get()
+        current_routing.set(None)
+        if request.method in SAFE_METHODS and (routing is None or not routing.has_written):
+            return response
+
+        response.set_cookie(
+            READ_PRIMARY_COOKIE,
+            str(int(time.time()) + DATABASE_READ_YOUR_WRITES_SECONDS),
+            max_age=DATABASE_READ_YOUR_WRITES_SECONDS,
+            httponly=True,
+            secure=settings.SESSION_COOKIE_SECURE,
+            samesite=settings.SESSION_COOKIE_SAMESITE,
+        )
+        return response
 
 
 class CustomMiddleware(MiddlewareMixin):
@@ -2,6 +2,7 @@ import logging
 import os
 from pathlib import Path
 
+from .database import get_psql_database, get_replica_databases
 from .environment import DjangoSettings, env
 from .jwt import get_jwt_config
 from .logging import get_logging_config
@@ -101,6 +102,9 @@ CORS_ALLOW_CREDENTIALS = True
 SIMPLE_JWT = get_jwt_config(ENV)
 
 MIDDLEWARE = [
+    'backend.middleware.RequestIdMiddleware',
+    'backend.middleware.TracingMiddleware',
+    'backend.middleware.ReadReplicaMiddleware',
     'corsheaders.middleware.CorsMiddleware',
 
     'django.middleware.security.SecurityMiddleware',
@@ -139,15 +143,9 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 
 if ENV.application.use_local_postgres:
     DATABASES = {
-        "default": {
-            "ENGINE": "django.db.backends.postgresql",
-            "NAME": ENV.database.psql.db_name,
-            "PORT": ENV.database.psql.db_port,
-            "HOST": ENV.database.psql.db_host,
-            "USER": ENV.database.psql.db_user,
-            "PASSWORD": ENV.database.psql.db_password
-        },
+        "default": get_psql_database(ENV),
     }
+    DATABASES.update(get_replica_databases(ENV, DATABASES["default"]))
 else:
     DATABASES = {
         'default': {
@@ -156,6 +154,12 @@ else:
         }
     }
 
+# Reads of requests go to the replicas when there are any
+DATABASE_ROUTERS = ['backend.settings.db_router.ReplicaRouter']
+DATABASE_MAX_REPLICA_LAG = ENV.database.psql.max_replica_lag
+DATABASE_REPLICA_CHECK_INTERVAL = ENV.database.psql.replica_check_interval
+DATABASE_READ_YOUR_WRITES_SECONDS = ENV.database.psql.read_your_writes_seconds
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -195,22 +199,38 @@ if ENV.database.redis.username:
 
 redis_location = f'redis://{prefix_auth}{ENV.database.redis.host}:{ENV.database.redis.port}/{ENV.database.redis.db_index}'
 
+REDIS_CACHE_OPTIONS = {
+    'serializer': ENV.database.redis.serializer,
+    'compressor': ENV.database.redis.compressor,
+    'compress_min_length': ENV.database.redis.compress_min_length,
+    'near_cache_size': ENV.database.redis.near_cache_size,
+    'near_cache_ttl': ENV.database.redis.near_cache_ttl,
+    'sharded': bool(ENV.database.redis.shard_locations),
+    'max_replica_lag': ENV.database.redis.max_replica_lag,
+    'metrics': ENV.database.redis.metrics,
+    'metrics_log_interval': ENV.database.redis.metrics_log_interval,
+}
+
 CACHES = {
     "default": {
         "BACKEND": "backend.settings.redis.RedisCache",
-        "LOCATION": redis_location,
+        "LOCATION": ENV.database.redis.shard_locations or [
+            redis_location, *ENV.database.redis.replica_locations
+        ],
+        "OPTIONS": REDIS_CACHE_OPTIONS,
     },
 }
 
 RQ_QUEUES = {
-    'default': {
+    name: {
         'HOST': ENV.database.redis.host,
         'PORT': ENV.database.redis.port,
         'DB': ENV.database.redis.db_index,
         'USERNAME': ENV.database.redis.username,
         'PASSWORD': ENV.database.redis.password,
         'DEFAULT_TIMEOUT': 360,
-    },
+    }
+    for name in dict.fromkeys([*ENV.database.redis.rq_queues, 'default'])
 }
 
 # Internationalization
@@ -289,6 +309,9 @@ SPECTACULAR_SETTINGS = {
 # SMTP settings. Adjust for SMTP provider
 SMTP_API_URL = ENV.integration.smtp.api_url
 SMTP_API_KEY = ENV.integration.smtp.api_key
+SMTP_RATE_LIMIT = ENV.integration.smtp.rate_limit
+SMTP_CONCURRENCY = ENV.integration.smtp.concurrency
+SMTP_MAX_RETRIES = ENV.integration.smtp.max_retries
 DEFAULT_EMAIL_SENDER= ENV.application.default_email_sender
 
 
@@ -299,10 +322,30 @@ DOMAIN = ENV.application.domain
 UI_DOMAIN = ENV.application.ui_domain
 
 
+# Outbound requests to integrations, see services.http_client
+INTEGRATION_HTTP_OPTIONS = {
+    'timeout': ENV.integration.http.timeout,
+    'connect_timeout': ENV.integration.http.connect_timeout,
+    'max_connections': ENV.integration.http.max_connections,
+    'max_keepalive_connections': ENV.integration.http.max_keepalive_connections,
+    'keepalive_expiry': ENV.integration.http.keepalive_expiry,
+    'retries': ENV.integration.http.retries,
+    'http2': ENV.integration.http.http2,
+}
+
+
+# Request tracing, see backend.middleware.TracingMiddleware
+TRACING_ENABLED = ENV.logging_config.tracing.enabled
+TRACING_SAMPLE_RATE = ENV.logging_config.tracing.sample_rate
+TRACING_SLOW_REQUEST_MS = ENV.logging_config.tracing.slow_request_ms
+TRACING_SERVER_TIMING = ENV.logging_config.tracing.server_timing
+
 # Cloudflare
 CLOUDFLARE_TURNSTILE_SITE_KEY = ENV.integration.cloudflare.site_key
 CLOUDFLARE_TURNSTILE_SECRET_KEY = ENV.integration.cloudflare.secret_key
 CLOUDFLARE_TURNSTILE_VERIFY_URL = ENV.integration.cloudflare.verify_api_url
+CLOUDFLARE_TURNSTILE_VERIFY_TIMEOUT = ENV.integration.cloudflare.verify_timeout
+CLOUDFLARE_TURNSTILE_ALLOW_WHEN_UNAVAILABLE = ENV.integration.cloudflare.allow_when_unavailable
 
 CSRF_TRUSTED_ORIGINS = ENV.application.csrf_trusted_origins
 
@@ -310,6 +353,8 @@ BRAND_NAME = ENV.application.brand_name
 
 RQ_API_TOKEN = ENV.application.rq_api_token
 
+METRICS_API_TOKEN = ENV.application.metrics_api_token
+
 IS_DEMO_MODE = ENV.application.is_demo_mode
 
 log.info('Base settings loaded')
@@ -0,0 +1,191 @@
+"""
+    Opt-in instrumentation of backend.settings.redis.RedisCache. Enabled with
+    OPTIONS['metrics'] = True. Metrics are kept per process (each gunicorn
+    worker has its own) and are exposed in prometheus text format by
+    backend.views.cache_metrics and as periodic structured log lines.
+"""
+
+import bisect
+import logging
+import os
+import threading
+import time
+
+from backend.settings.logging import LoggerContext
+
+log = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# Keys are grouped for hit ratios by the first of these they start with,
+# otherwise by what comes before their first ':'
+DEFAULT_KEY_PREFIXES = ('django.contrib.sessions.cache', 'throttle_', 'tag:')
+
+# Bounds the number of prefix labels. Keys of new prefixes past this count
+# are grouped under 'other'.
+MAX_KEY_PREFIXES = 50
+
+
+class Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        # The last count is for values above the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def get_cumulative_counts(self) -> list[tuple[str, int]]:
+        ret = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            ret.append((str(bound), total))
+        ret.append(('+Inf', self.count))
+        return ret
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class CacheMetrics:
+    def __init__(
+        self,
+        key_prefixes: tuple = DEFAULT_KEY_PREFIXES,
+        top_keys: int = 20,
+        log_interval: float = 60,
+    ):
+        self._key_prefixes = tuple(key_prefixes)
+        self._top_keys = top_keys
+        self._log_interval = log_interval
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._latencies = {}
+        self._sizes = Histogram(SIZE_BUCKETS)
+        # prefix -> [hits, misses]
+        self._lookups = {}
+        # key -> size of the largest values written
+        self._largest = {}
+        self._largest_min = 0
+        self._last_log = time.monotonic()
+
+    def _check_fork(self):
+        # Counters inherited from the parent process would be reported twice
+        if self._pid != os.getpid():
+            self._reset()
+
+    def get_key_prefix(self, key: str) -> str:
+        for prefix in self._key_prefixes:
+            if key.startswith(prefix):
+                return prefix
+        prefix, sep, _ = key.partition(':')
+        if not sep:
+            return 'other'
+        if prefix not in self._lookups and len(self._lookups) >= MAX_KEY_PREFIXES:
+            return 'other'
+        return prefix
+
+    def observe_latency(self, operation: str, seconds: float):
+        with self._lock:
+            self._check_fork()
+            histogram = self._latencies.get(operation)
+            if histogram is None:
+                histogram = self._latencies[operation] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+        self._log_if_due()
+
+    def observe_size(self, key: str, value):
+        """ value is what the serializer produced, an int or bytes """
+        size = len(str(value)) if type(value) is int else len(value)
+        with self._lock:
+            self._check_fork()
+            self._sizes.observe(size)
+            if size <= self._largest_min and key not in self._largest:
+                return
+            self._largest[key] = size
+            if len(self._largest) > self._top_keys:
+                del self._largest[min(self._largest, key=self._largest.get)]
+            if len(self._largest) >= self._top_keys:
+                self._largest_min = min(self._largest.values())
+
+    def observe_lookups(self, keys, hits):
+        """ keys are the keys looked up, before they are made into cache keys """
+        with self._lock:
+            self._check_fork()
+            for key in keys:
+                counts = self._lookups.setdefault(self.get_key_prefix(key), [0, 0])
+                counts[0 if key in hits else 1] += 1
+
+    def get_snapshot(self) -> dict:
+        with self._lock:
+            self._check_fork()
+            return {
+                'pid': self._pid,
+                'operations': {
+                    operation: {
+                        'count': histogram.count,
+                        'avg_ms': round(histogram.sum / histogram.count * 1000, 3),
+                    }
+                    for operation, histogram in self._latencies.items()
+                },
+                'hit_ratios': {
+                    prefix: round(hits / (hits + misses), 4)
+                    for prefix, (hits, misses) in self._lookups.items()
+                },
+                'avg_value_bytes': round(self._sizes.sum / self._sizes.count) if self._sizes.count else 0,
+                'largest_keys': sorted(self._largest.items(), key=lambda item: -item[1]),
+            }
+
+    def _log_if_due(self):
+        if time.monotonic() - self._last_log < self._log_interval:
+            return
+        self._last_log = time.monotonic()
+        log_ctx = LoggerContext(type='CACHE_METRICS', context=self.get_snapshot())
+        log.info('Cache metrics', extra=log_ctx)
+
+    def to_prometheus(self) -> str:
+        """ Metrics in prometheus text exposition format """
+        with self._lock:
+            self._check_fork()
+            pid = self._pid
+            lines = [
+                '# HELP cache_operation_seconds Latency of cache operations',
+                '# TYPE cache_operation_seconds histogram',
+            ]
+            for operation, histogram in self._latencies.items():
+                labels = f'pid="{pid}",operation="{operation}"'
+                for bound, count in histogram.get_cumulative_counts():
+                    lines.append(f'cache_operation_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'cache_operation_seconds_sum{{{labels}}} {histogram.sum}')
+                lines.append(f'cache_operation_seconds_count{{{labels}}} {histogram.count}')
+
+            lines.append('# HELP cache_value_bytes Size of values written to the cache')
+            lines.append('# TYPE cache_value_bytes histogram')
+            for bound, count in self._sizes.get_cumulative_counts():
+                lines.append(f'cache_value_bytes_bucket{{pid="{pid}",le="{bound}"}} {count}')
+            lines.append(f'cache_value_bytes_sum{{pid="{pid}"}} {self._sizes.sum}')
+            lines.append(f'cache_value_bytes_count{{pid="{pid}"}} {self._sizes.count}')
+
+            lines.append('# HELP cache_lookups_total Cache reads by key prefix and result')
+            lines.append('# TYPE cache_lookups_total counter')
+            for prefix, (hits, misses) in self._lookups.items():
+                prefix = _escape_label(prefix)
+                lines.append(f'cache_lookups_total{{pid="{pid}",prefix="{prefix}",result="hit"}} {hits}')
+                lines.append(f'cache_lookups_total{{pid="{pid}",prefix="{prefix}",result="miss"}} {misses}')
+
+            lines.append('# HELP cache_largest_value_bytes Largest values written to the cache')
+            lines.append('# TYPE cache_largest_value_bytes gauge')
+            for key, size in self._largest.items():
+                lines.append(f'cache_largest_value_bytes{{pid="{pid}",key="{_escape_label(key)}"}} {size}')
+
+        return '\n'.join(lines) + '\n'
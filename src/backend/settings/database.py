@@ -0,0 +1,60 @@
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import psycopg_pool
+except ImportError:
+    psycopg_pool = None
+
+
+def get_psql_database(ENV: dict) -> dict:
+    """
+        Connections are kept open for conn_max_age seconds and checked before
+        they are reused, or taken from a psycopg pool when pool is true. Django
+        does not support both, so conn_max_age is ignored with pool.
+    """
+    psql = ENV.database.psql
+    database = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": psql.db_name,
+        "PORT": psql.db_port,
+        "HOST": psql.db_host,
+        "USER": psql.db_user,
+        "PASSWORD": psql.db_password,
+        "CONN_MAX_AGE": psql.conn_max_age,
+        "CONN_HEALTH_CHECKS": psql.conn_health_checks,
+        # Transaction pooling of pgbouncer gives each transaction any server
+        # connection, so cursors cannot outlive a transaction
+        "DISABLE_SERVER_SIDE_CURSORS": psql.pgbouncer,
+        "OPTIONS": {
+            "connect_timeout": psql.connect_timeout,
+        },
+    }
+
+    if psql.pool:
+        if psycopg_pool is None:
+            raise ImproperlyConfigured('psycopg[pool] is required to use pool for postgres')
+        database["CONN_MAX_AGE"] = 0
+        database["OPTIONS"]["pool"] = {
+            "min_size": psql.pool_min_size,
+            "max_size": psql.pool_max_size,
+            "timeout": psql.pool_timeout,
+        }
+    return database
+
+
+def get_replica_databases(ENV: dict, primary: dict) -> dict:
+    """
+        Read replicas of the primary from replica_hosts, 'host' or 'host:port'.
+        Tests use the primary for them, see backend.settings.db_router.
+    """
+    replicas = {}
+    for index, replica_host in enumerate(ENV.database.psql.replica_hosts):
+        host, _, port = replica_host.partition(':')
+        replicas[f'replica_{index}'] = {
+            **primary,
+            "HOST": host,
+            "PORT": int(port) if port else primary["PORT"],
+            "OPTIONS": dict(primary["OPTIONS"]),
+            "TEST": {"MIRROR": "default"},
+        }
+    return replicas
@@ -0,0 +1,160 @@
+"""
+    Sends the reads of requests to the read replicas of the default
+    database, which are the DATABASES with TEST MIRROR set to 'default'.
+    Reads go to the primary:
+    - outside of requests, e.g. in RQ jobs and management commands
+    - within transactions and after a write in the same request
+    - for DATABASE_READ_YOUR_WRITES_SECONDS after a request that wrote,
+      for the same browser, see backend.middleware.ReadReplicaMiddleware
+    - when every replica lags more than DATABASE_MAX_REPLICA_LAG seconds
+"""
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, router
+
+from backend.settings.base import (
+    DATABASE_MAX_REPLICA_LAG,
+    DATABASE_REPLICA_CHECK_INTERVAL,
+)
+
+log = logging.getLogger(__name__)
+
+# 0 when the replica replayed all it received, otherwise seconds since the
+# last replayed transaction. NULL when the server is not a standby.
+REPLICATION_LAG_SQL = '''
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+'''
+
+
+def get_replica_aliases() -> list[str]:
+    return [
+        alias for alias, database in settings.DATABASES.items()
+        if database.get('TEST', {}).get('MIRROR') == DEFAULT_DB_ALIAS
+    ]
+
+
+class ReadRouting:
+    def __init__(self, use_primary: bool):
+        self.use_primary = use_primary
+        self.has_written = False
+
+
+# Routing of the request being handled, set by ReadReplicaMiddleware
+current_routing: ContextVar[ReadRouting | None] = ContextVar('current_routing', default=None)
+
+
+def get_replication_lag(alias: str) -> float | None:
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(REPLICATION_LAG_SQL)
+        lag = cursor.fetchone()[0]
+    return None if lag is None else float(lag)
+
+
+class ReplicaSet:
+    """
+        Replicas that reads can go to. Their lag is checked at most every
+        check_interval seconds per process, by the read that finds the last
+        check too old. Replicas that lag more than max_lag or fail the check
+        are skipped until a later check finds them caught up.
+    """
+    def __init__(self, aliases: list[str], max_lag: float, check_interval: float):
+        self.aliases = aliases
+        self._max_lag = max_lag
+        self._check_interval = check_interval
+        self._healthy = list(aliases)
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _check(self):
+        healthy = []
+        for alias in self.aliases:
+            try:
+                lag = get_replication_lag(alias)
+            except DatabaseError as e:
+                reason = str(e)
+            else:
+                if lag is None or lag <= self._max_lag:
+                    healthy.append(alias)
+                    if alias not in self._healthy:
+                        log.info(f'Readmitted database replica {alias}')
+                    continue
+                reason = f'{lag:.1f}s behind'
+            if alias in self._healthy:
+                log.warning(f'Ejected database replica {alias}: {reason}')
+        self._healthy = healthy
+        self._checked_at = time.monotonic()
+
+    def choose(self) -> str | None:
+        """ A healthy replica, None when there is none """
+        is_due = self._checked_at is None or time.monotonic() - self._checked_at >= self._check_interval
+        # Other reads keep using the last result while one checks
+        if is_due and self._lock.acquire(blocking=False):
+            try:
+                self._check()
+            finally:
+                self._lock.release()
+        healthy = self._healthy
+        return random.choice(healthy) if healthy else None
+
+
+class ReplicaRouter:
+    def __init__(self):
+        aliases = get_replica_aliases()
+        self.replicas = ReplicaSet(aliases, DATABASE_MAX_REPLICA_LAG, DATABASE_REPLICA_CHECK_INTERVAL) if aliases else None
+
+    def get_read_alias(self) -> str:
+        routing = current_routing.get()
+        if self.replicas is None or routing is None or routing.use_primary:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return self.replicas.choose() or DEFAULT_DB_ALIAS
+
+    def db_for_read(self, model, **hints):
+        if self.replicas is None:
+            return None
+        return self.get_read_alias()
+
+    def db_for_write(self, model, **hints):
+        if self.replicas is None:
+            return None
+        routing = current_routing.get()
+        if routing is not None:
+            routing.use_primary = routing.has_written = True
+        # Also for objects read from a replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if self.replicas is None:
+            return None
+        aliases = {DEFAULT_DB_ALIAS, *self.replicas.aliases}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if self.replicas is not None and db in self.replicas.aliases:
+            return False
+        return None
+
+
+def get_read_alias() -> str:
+    """
+        Database alias for raw sql that only reads, e.g.
+        with connections[get_read_alias()].cursor() as cursor:
+    """
+    for database_router in router.routers:
+        if isinstance(database_router, ReplicaRouter):
+            return database_router.get_read_alias()
+    return DEFAULT_DB_ALIAS
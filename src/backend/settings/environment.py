@@ -60,6 +60,7 @@ class Environment:
         csrf_trusted_origins: list[str] = _application_env.get('csrf_trusted_origins')
         brand_name: str = _application_env.get('brand_name', 'CUSTOM DJANGO ADMIN')
         rq_api_token: str = _application_env.get('rq_api_token', '')
+        metrics_api_token: str = _application_env.get('metrics_api_token', '')
         is_demo_mode: bool = _application_env.get('is_demo_mode', False)
 
         
@@ -68,6 +69,11 @@ class Environment:
 
         handlers: list[str] = _logging_config_env.get('handlers', ['console'])
         gunicorn_log_path: str = _logging_config_env.get('gunicorn_log_path')
+        log_format: str = _logging_config_env.get('log_format', 'text')
+        use_queue: bool = _logging_config_env.get('use_queue', False)
+        queue_size: int = _logging_config_env.get('queue_size', 10000)
+        queue_batch_size: int = _logging_config_env.get('queue_batch_size', 100)
+        queue_sample_rate: int = _logging_config_env.get('queue_sample_rate', 10)
 
         class FileHandler:
             _file_handler_env = env_config.get('logging_config', {}).get('file_handler', {})
@@ -82,8 +88,17 @@ class Environment:
 
             log_level: str = _console_handler_env.get('log_level')
 
+        class Tracing:
+            _tracing_env = env_config.get('logging_config', {}).get('tracing', {})
+
+            enabled: bool = _tracing_env.get('enabled', False)
+            sample_rate: int = _tracing_env.get('sample_rate', 100)
+            slow_request_ms: float = _tracing_env.get('slow_request_ms', 1000)
+            server_timing: bool = _tracing_env.get('server_timing', True)
+
         file_handler = FileHandler()
         console_handler = ConsoleHandler()
+        tracing = Tracing()
 
 
     class Integration:
@@ -102,6 +117,21 @@ class Environment:
 
             api_url = _smtp2go_env.get('api_url')
             api_key: str = _smtp2go_env.get('api_key')
+            rate_limit: float = _smtp2go_env.get('rate_limit', 10)
+            concurrency: int = _smtp2go_env.get('concurrency', 10)
+            max_retries: int = _smtp2go_env.get('max_retries', 5)
+
+
+        class Http:
+            _http_env = env_config.get('integration', {}).get('http', {})
+
+            timeout: float = _http_env.get('timeout', 10)
+            connect_timeout: float = _http_env.get('connect_timeout', 5)
+            max_connections: int = _http_env.get('max_connections', 20)
+            max_keepalive_connections: int = _http_env.get('max_keepalive_connections', 10)
+            keepalive_expiry: float = _http_env.get('keepalive_expiry', 30)
+            retries: int = _http_env.get('retries', 2)
+            http2: bool = _http_env.get('http2', False)
 
 
         class Cloudflare:
@@ -110,9 +140,12 @@ class Environment:
             site_key: str = _cloudflare_env.get('site_key')
             secret_key: str = _cloudflare_env.get('secret_key')
             verify_api_url: str = _cloudflare_env.get('verify_api_url')
+            verify_timeout: float = _cloudflare_env.get('verify_timeout', 3)
+            allow_when_unavailable: bool = _cloudflare_env.get('allow_when_unavailable', False)
 
         aws = AWS()
         smtp = Smtp2Go()
+        http = Http()
         cloudflare = Cloudflare()
 
 
@@ -125,6 +158,18 @@ class Environment:
             db_host: str = _psql_env.get('db_host')
             db_user: str = _psql_env.get('db_user')
             db_password: str = _psql_env.get('db_password')
+            conn_max_age: int = _psql_env.get('conn_max_age', 60)
+            conn_health_checks: bool = _psql_env.get('conn_health_checks', True)
+            connect_timeout: int = _psql_env.get('connect_timeout', 5)
+            pgbouncer: bool = _psql_env.get('pgbouncer', False)
+            pool: bool = _psql_env.get('pool', False)
+            pool_min_size: int = _psql_env.get('pool_min_size', 2)
+            pool_max_size: int = _psql_env.get('pool_max_size', 10)
+            pool_timeout: float = _psql_env.get('pool_timeout', 10)
+            replica_hosts: list[str] = _psql_env.get('replica_hosts', [])
+            max_replica_lag: float = _psql_env.get('max_replica_lag', 10)
+            replica_check_interval: float = _psql_env.get('replica_check_interval', 5)
+            read_your_writes_seconds: int = _psql_env.get('read_your_writes_seconds', 10)
 
         class Redis:
             _redis_env = env_config.get('database', {}).get('redis', {})
@@ -135,6 +180,17 @@ class Environment:
             port: int = _redis_env.get('port')
             db_index: int = _redis_env.get('db_index')
             test_db_index: int = _redis_env.get('test_db_index')
+            serializer: str = _redis_env.get('serializer', 'json')
+            compressor: str = _redis_env.get('compressor', '')
+            compress_min_length: int = _redis_env.get('compress_min_length', 1024)
+            near_cache_size: int = _redis_env.get('near_cache_size', 0)
+            near_cache_ttl: float = _redis_env.get('near_cache_ttl', 5)
+            shard_locations: list[str] = _redis_env.get('shard_locations', [])
+            replica_locations: list[str] = _redis_env.get('replica_locations', [])
+            max_replica_lag: int = _redis_env.get('max_replica_lag', 30)
+            metrics: bool = _redis_env.get('metrics', False)
+            metrics_log_interval: int = _redis_env.get('metrics_log_interval', 60)
+            rq_queues: list[str] = _redis_env.get('rq_queues', ['high', 'default', 'low'])
 
         psql = PSQL()
         redis = Redis()
@@ -1,6 +1,42 @@
+import copy
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from collections.abc import Mapping
+from contextvars import ContextVar
+from datetime import datetime, timezone
 from typing import Literal
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Logger whose handlers write the records taken from the queue when
+# logging_config.use_queue is true
+LOG_SINK = 'backend.log_sink'
+
+# Seconds an ERROR or CRITICAL record waits for room in a full queue
+# before it is dropped
+ERROR_PUT_TIMEOUT = 0.1
+
+# Least seconds between two log lines of dropped record counts
+DROPS_LOG_INTERVAL = 60
+
+
+class RequestContext:
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.started_at = time.perf_counter()
+
+
+# The request being handled, set by backend.middleware.RequestIdMiddleware
+current_request: ContextVar[RequestContext | None] = ContextVar('current_request', default=None)
+
 
 class DjangoRQFilter(logging.Filter):
     def filter(self, record):
@@ -8,38 +44,295 @@ class DjangoRQFilter(logging.Filter):
             return record.levelno >= logging.WARNING
         return True
 
+
+class RequestContextFilter(logging.Filter):
+    """
+        Adds the id of the request being handled and the ms since it started.
+        They are only set by the first handler that sees a record, so records
+        written by the queue listener keep the values of the thread that
+        logged them.
+    """
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            request_context = current_request.get()
+            if request_context is None:
+                record.request_id = record.request_elapsed_ms = None
+            else:
+                record.request_id = request_context.request_id
+                record.request_elapsed_ms = round((time.perf_counter() - request_context.started_at) * 1000, 3)
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """ Appends the LoggerContext of a record to its message """
+    def formatMessage(self, record):
+        log_ctx = getattr(record, 'log_ctx', None)
+        if log_ctx is not None:
+            record.message = f'{record.message}: {log_ctx.__dict__}'
+        return super().formatMessage(record)
+
+
+def _dumps(data: dict) -> str:
+    if orjson is not None:
+        return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(data, default=str, separators=(',', ':'))
+
+
+class JSONFormatter(logging.Formatter):
+    """ One json object per record, using orjson when it is installed """
+    def format(self, record):
+        data = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'line': record.lineno,
+            'message': record.getMessage(),
+            'pid': record.process,
+            'request_id': getattr(record, 'request_id', None),
+            'request_elapsed_ms': getattr(record, 'request_elapsed_ms', None),
+        }
+        log_ctx = getattr(record, 'log_ctx', None)
+        if log_ctx is not None:
+            data.update(log_ctx.__dict__)
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        if record.stack_info:
+            data['stack'] = self.formatStack(record.stack_info)
+        return _dumps(data)
+
+
+_exception_formatter = logging.Formatter()
+
+
+class BatchEmitMixin:
+    """ Writes a batch of records with one write and one flush """
+    def handle_batch(self, records: list[logging.LogRecord]):
+        lines = []
+        for record in records:
+            if record.levelno < self.level or not self.filter(record):
+                continue
+            try:
+                lines.append(self.format(record) + self.terminator)
+            except Exception:
+                self.handleError(record)
+        if not lines:
+            return
+
+        with self.lock:
+            try:
+                self.write_batch(''.join(lines))
+            except Exception:
+                self.handleError(records[-1])
+
+    def write_batch(self, text: str):
+        self.stream.write(text)
+        self.flush()
+
+
+class BatchStreamHandler(BatchEmitMixin, logging.StreamHandler):
+    pass
+
+
+class BatchRotatingFileHandler(BatchEmitMixin, logging.handlers.RotatingFileHandler):
+    def write_batch(self, text: str):
+        if self.stream is None:
+            self.stream = self._open()
+        # Rolls over once per batch so a file can exceed maxBytes by a batch
+        position = self.stream.tell()
+        if self.maxBytes > 0 and position and position + len(text) >= self.maxBytes:
+            self.doRollover()
+        super().write_batch(text)
+
+
+class QueueLoggingHandler(logging.handlers.QueueHandler):
+    """
+        Puts records on a bounded queue so that logging never waits for I/O.
+        A listener thread writes them in batches with the handlers of the
+        LOG_SINK logger.
+        Once the queue is more than 80% full, 1 in sample_rate records below
+        WARNING are kept. When it is full, records below ERROR are dropped and
+        the others wait up to ERROR_PUT_TIMEOUT seconds. Dropped records are
+        counted and logged every DROPS_LOG_INTERVAL seconds.
+        The queue and listener are recreated in a forked process, e.g. a
+        gunicorn worker of a preloaded app, since the thread does not survive
+        the fork.
+    """
+    def __init__(self,
+                 sink: str = LOG_SINK,
+                 queue_size: int = 10000,
+                 batch_size: int = 100,
+                 sample_rate: int = 10):
+        super().__init__(None)
+        self._sink = sink
+        self._queue_size = queue_size
+        self._high_watermark = int(queue_size * 0.8)
+        self._batch_size = batch_size
+        self._sample_rate = max(sample_rate, 1)
+        self._fork_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self.queue = queue.Queue(self._queue_size)
+        self._thread = None
+        self._sampled = 0
+        self._dropped = {}
+        self._dropped_lock = threading.Lock()
+        self._reported = {}
+        self._reported_at = time.monotonic()
+
+    def _ensure_listener(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._fork_lock:
+            if self._pid != os.getpid():
+                # Records the parent did not write yet stay with the parent
+                self._reset()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name='log-queue-listener', daemon=True)
+                self._thread.start()
+
+    def _count_drop(self, record: logging.LogRecord):
+        with self._dropped_lock:
+            self._dropped[record.levelname] = self._dropped.get(record.levelname, 0) + 1
+
+    def get_dropped(self) -> dict[str, int]:
+        """ Number of records dropped by level name in this process """
+        with self._dropped_lock:
+            return dict(self._dropped)
+
+    def emit(self, record: logging.LogRecord):
+        self._ensure_listener()
+        if record.levelno < logging.WARNING and self.queue.qsize() >= self._high_watermark:
+            self._sampled += 1
+            if self._sampled % self._sample_rate:
+                self._count_drop(record)
+                return
+        super().emit(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike QueueHandler.prepare, keeps the traceback out of the message
+        # so that formatters place it
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+
+        if record.levelno >= logging.ERROR:
+            try:
+                self.queue.put(record, timeout=ERROR_PUT_TIMEOUT)
+                return
+            except queue.Full:
+                pass
+        self._count_drop(record)
+
+    def _listen(self):
+        while True:
+            records = [self.queue.get()]
+            try:
+                while len(records) < self._batch_size:
+                    records.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            is_closed = None in records
+            self._write([record for record in records if record is not None])
+            self._report_drops()
+            if is_closed:
+                return
+
+    def _write(self, records: list[logging.LogRecord]):
+        for handler in logging.getLogger(self._sink).handlers:
+            if hasattr(handler, 'handle_batch'):
+                handler.handle_batch(records)
+                continue
+            for record in records:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def _report_drops(self):
+        if time.monotonic() - self._reported_at < DROPS_LOG_INTERVAL:
+            return
+        dropped = self.get_dropped()
+        if dropped == self._reported:
+            return
+
+        self._reported = dropped
+        self._reported_at = time.monotonic()
+        log_ctx = LoggerContext(type='LOGGING_METRICS', context={'dropped': dropped})
+        record = logging.getLogger(__name__).makeRecord(
+            __name__, logging.WARNING, __file__, 0, 'Log records dropped', None, None, extra=log_ctx
+        )
+        self._write([record])
+
+    def close(self):
+        # Writes what is left in the queue before the process exits
+        with self._fork_lock:
+            thread = self._thread if self._pid == os.getpid() else None
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            try:
+                self.queue.put(None, timeout=1)
+            except queue.Full:
+                pass
+            thread.join(5)
+        super().close()
+
     
 def get_logging_config(ENV: dict) -> dict:
-    return {
+    use_queue = ENV.logging_config.use_queue
+    formatter = 'json' if ENV.logging_config.log_format == 'json' else 'verbose'
+    config = {
         'version': 1,
         'disable_existing_loggers': False,
         'handlers': {
             'file': {
                 'level': ENV.logging_config.file_handler.log_level, 
-                'class': 'logging.handlers.RotatingFileHandler',
+                'class': 'backend.settings.logging.BatchRotatingFileHandler' if use_queue else 'logging.handlers.RotatingFileHandler',
                 'filename': f'{ENV.logging_config.file_handler.log_path}/app.log',
-                'formatter': 'verbose',
+                'formatter': formatter,
                 'maxBytes': ENV.logging_config.file_handler.max_bytes,  
                 'backupCount': ENV.logging_config.file_handler.backup_count,
-                'filters': ['django_rq_filter']
+                'filters': ['django_rq_filter', 'request_context']
             },
             'console': {
                 'level': ENV.logging_config.console_handler.log_level,
-                'class': 'logging.StreamHandler',
-                'formatter': 'verbose',
+                'class': 'backend.settings.logging.BatchStreamHandler' if use_queue else 'logging.StreamHandler',
+                'formatter': formatter,
+                'filters': ['request_context'],
             },
         },
         'formatters': {
             'verbose': {
+                'class': 'backend.settings.logging.TextFormatter',
                 'format': '{asctime} {levelname} [{name}:{lineno}] {message}',
                 'style': '{',
                 'datefmt': '%Y-%m-%dT%H:%M:%S%z'
             },
+            'json': {
+                '()': JSONFormatter,
+            },
         },
         'filters': {
             'django_rq_filter': {
                 '()': DjangoRQFilter,
             },
+            'request_context': {
+                '()': RequestContextFilter,
+            },
         },
         'root': {
             'handlers': ENV.logging_config.handlers,
@@ -47,17 +340,52 @@ def get_logging_config(ENV: dict) -> dict:
         },
     }
 
+    if use_queue:
+        config['handlers']['queue'] = {
+            '()': QueueLoggingHandler,
+            'queue_size': ENV.logging_config.queue_size,
+            'batch_size': ENV.logging_config.queue_batch_size,
+            'sample_rate': ENV.logging_config.queue_sample_rate,
+            'filters': ['request_context'],
+        }
+        config['loggers'] = {
+            LOG_SINK: {
+                'handlers': ENV.logging_config.handlers,
+                'level': 'DEBUG',
+                'propagate': False,
+            },
+        }
+        config['root']['handlers'] = ['queue']
+    return config
+
 
 LOG_CONTEXT_TYPE = Literal[
     'LOGIN_SUCCESS', 'CHANGE_PASSWORD_SUCCESS', 'GENERAL_ERROR',
     'EMAIL_SUCCESS', 'EMAIL_ERROR', 'GENERAL_DEBUG', 'GENERAL_INFO', 
+    'CACHE_METRICS', 'LOGGING_METRICS', 'REQUEST_TRACE', 'SLOW_REQUEST',
 ]
 
-class LoggerContext:
+class LoggerContext(Mapping):
     """
-        Object to hold the context of a log.
+        Object to hold the context of a log. It is passed as the extra of a
+        log call and only formatted by the handlers that write the record:
+        log.info('Email sent', extra=LoggerContext(type='EMAIL_SUCCESS', context=context))
         NOTE: Do not put a non-serializable value!!!
     """
-    def __init__(self, type: LOG_CONTEXT_TYPE, context: dict = {}):
+    def __init__(self, type: LOG_CONTEXT_TYPE, context: dict = {}, duration: float | None = None):
         self.type = type
-        self.context = context
\ No newline at end of file
+        self.context = context
+        if duration is not None:
+            self.duration_ms = round(duration * 1000, 3)
+
+    # As a mapping, it sets record.log_ctx to itself
+    def __getitem__(self, key):
+        if key != 'log_ctx':
+            raise KeyError(key)
+        return self
+
+    def __iter__(self):
+        yield 'log_ctx'
+
+    def __len__(self):
+        return 1
\ No newline at end of file
@@ -41,14 +41,8 @@ AWS_S3_CUSTOM_DOMAIN_PRIVATE = f'{AWS_STORAGE_BUCKET_NAME_PRIVATE}.s3.{AWS_S3_RE
 
 # Ensure database always use postgres or production db choice
 DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.postgresql",
-        "NAME": ENV.database.psql.db_name,
-        "PORT": ENV.database.psql.db_port,
-        "HOST": ENV.database.psql.db_host,
-        "USER": ENV.database.psql.db_user,
-        "PASSWORD": ENV.database.psql.db_password
-    },
+    "default": get_psql_database(ENV),
 }
+DATABASES.update(get_replica_databases(ENV, DATABASES["default"]))
 
 log.info(f'Production settings loaded')
\ No newline at end of file
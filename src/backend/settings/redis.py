@@ -5,26 +5,405 @@
     NOTE: This is only used for djangorq and admin sessions.
 """
 
+import asyncio
+import bisect
+import hashlib
 import json
+import logging
+import math
+import os
 import random
 import re
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from typing import Any
+from urllib.parse import urlsplit
+from weakref import WeakKeyDictionary
 
+from django.core.cache import caches
 from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.exceptions import ImproperlyConfigured
 from django.utils.functional import cached_property
 from django.utils.module_loading import import_string
 
+from backend.settings.cache_metrics import CacheMetrics
+from backend.settings.tracing import current_trace
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+log = logging.getLogger(__name__)
+
+
+# The first byte of a stored value tells which format it was written with so
+# that keys written by different serializers can be read during a rollout.
+# Values without a header are plain json or ints written by RedisSerializer.
+# None of these bytes can start a json document or an int.
+HEADER_JSON = 0x01
+HEADER_MSGPACK = 0x02
+HEADER_ZLIB = 0x10
+HEADER_LZ4 = 0x11
+
+
+def _loads_plain(data: bytes):
+    # Ints are stored as is so that redis INCR works on them
+    first = data[:1]
+    if first.isdigit() or (first == b'-' and data[1:2].isdigit()):
+        try:
+            return int(data)
+        except ValueError:
+            pass
+    return json.loads(data)
+
+
+def _loads_json(payload: bytes):
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+def _loads_msgpack(payload: bytes):
+    if msgpack is None:
+        raise ImproperlyConfigured('msgpack is required to read msgpack cache values')
+    return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+
+def _loads_lz4(payload: bytes):
+    if lz4_frame is None:
+        raise ImproperlyConfigured('lz4 is required to read lz4 compressed cache values')
+    return loads(lz4_frame.decompress(payload))
+
+
+_DECODERS = {
+    HEADER_JSON: _loads_json,
+    HEADER_MSGPACK: _loads_msgpack,
+    HEADER_ZLIB: lambda payload: loads(zlib.decompress(payload)),
+    HEADER_LZ4: _loads_lz4,
+}
+
+
+def loads(data: bytes):
+    """ Reads a value written by any of the serializers below """
+    decoder = _DECODERS.get(data[0]) if data else None
+    if decoder is None:
+        return _loads_plain(data)
+    return decoder(data[1:])
+
 
 class RedisSerializer:
+    """
+        Plain json without a header. This is the default and the format
+        of all values written before headers were introduced.
+    """
     def dumps(self, obj):
         if type(obj) is int:
             return obj
         return json.dumps(obj).encode('utf-8')
 
     def loads(self, data):
-        try:
-            return int(data)
-        except ValueError:
-            return json.loads(data.decode('utf-8'))
+        return loads(data)
+
+
+class JSONSerializer(RedisSerializer):
+    """ Compact json using orjson when it is installed """
+    header = bytes([HEADER_JSON])
+
+    def dumps(self, obj):
+        if type(obj) is int:
+            return obj
+        if orjson is not None:
+            return self.header + orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        return self.header + json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+class MsgPackSerializer(RedisSerializer):
+    """ Compact binary format. Requires msgpack """
+    header = bytes([HEADER_MSGPACK])
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImproperlyConfigured('msgpack is required to use MsgPackSerializer')
+
+    def dumps(self, obj):
+        if type(obj) is int:
+            return obj
+        return self.header + msgpack.packb(obj, use_bin_type=True)
+
+
+class CompressedSerializer:
+    """
+        Wraps another serializer and compresses values whose serialized size is
+        at least min_length bytes. Smaller values and ints are stored as is.
+    """
+    def __init__(self, serializer, compressor: str = 'zlib', min_length: int = 1024):
+        if compressor == 'zlib':
+            self._header = bytes([HEADER_ZLIB])
+            self._compress = zlib.compress
+        elif compressor == 'lz4':
+            if lz4_frame is None:
+                raise ImproperlyConfigured('lz4 is required to use the lz4 compressor')
+            self._header = bytes([HEADER_LZ4])
+            self._compress = lz4_frame.compress
+        else:
+            raise ImproperlyConfigured(f'Unknown cache compressor: {compressor}')
+
+        self._serializer = serializer
+        self._min_length = min_length
+
+    def dumps(self, obj):
+        value = self._serializer.dumps(obj)
+        if type(value) is int or len(value) < self._min_length:
+            return value
+
+        compressed = self._compress(value)
+        # Not worth storing compressed if it does not get any smaller
+        if len(compressed) + 1 >= len(value):
+            return value
+        return self._header + compressed
+
+    def loads(self, data):
+        return loads(data)
+
+
+# Names that can be used for OPTIONS['serializer'] aside from a dotted path
+SERIALIZERS = {
+    'json': RedisSerializer,
+    'fast-json': JSONSerializer,
+    'msgpack': MsgPackSerializer,
+}
+
+
+class NearCache:
+    """
+        Bounded per-process LRU of raw values read from redis. Entries expire
+        after ttl seconds or when the redis key expires, whichever comes first.
+        Values are only cached while the invalidation listener is subscribed
+        (active) so that writes from other processes are never missed.
+    """
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.active = False
+        # Bumped on every invalidation. A value read from redis is not cached
+        # if an invalidation arrived while it was being read.
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def set(self, key, value, timeout: float | None, generation: int):
+        ttl = self.ttl if timeout is None else min(self.ttl, timeout)
+        with self._lock:
+            if not self.active or generation != self.generation:
+                return
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, keys):
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+# Increments a key only if it exists so that incr() stays atomic and takes a
+# single round trip. Returns nil for a missing key.
+INCR_IF_EXISTS_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then
+    return false
+end
+return redis.call('incrby', KEYS[1], ARGV[1])
+"""
+
+
+# Adds keys to a tag set so that it lives at least as long as its longest
+# lived key. ARGV[1] is the timeout of the keys, -1 when they do not expire.
+# A set that is persistent, or that expires later, is left as it is.
+ADD_TO_TAG_SCRIPT = """
+local existed = redis.call('exists', KEYS[1])
+local ttl = redis.call('ttl', KEYS[1])
+redis.call('sadd', KEYS[1], unpack(ARGV, 2))
+local timeout = tonumber(ARGV[1])
+if timeout < 0 then
+    redis.call('persist', KEYS[1])
+elseif timeout > 0 and (existed == 0 or (ttl >= 0 and ttl < timeout)) then
+    redis.call('expire', KEYS[1], timeout)
+end
+"""
+
+# Max keys passed to one call of ADD_TO_TAG_SCRIPT, as lua unpack() is
+# limited by the size of the stack
+ADD_TO_TAG_BATCH_SIZE = 1000
+
+
+def get_server_name(url: str) -> str:
+    """ The url of a server without its credentials """
+    url = urlsplit(url)
+    return url.netloc.rpartition('@')[2] + url.path
+
+
+class ReplicaHealth:
+    """
+        Health of a read replica. Updated by reads routed to it and by the
+        background probes. A replica is ejected after max_failures consecutive
+        errors or when it lags too far behind the primary, and is readmitted
+        after readmit_after consecutive good probes.
+    """
+    def __init__(self, name: str, ewma_alpha: float, max_failures: int, readmit_after: int):
+        self.name = name
+        self.healthy = True
+        # Exponentially weighted moving average of response times in seconds
+        self.latency = None
+        self.lag = None
+        self.requests = 0
+        self.errors = 0
+        self.last_error = ''
+        self._ewma_alpha = ewma_alpha
+        self._max_failures = max_failures
+        self._readmit_after = readmit_after
+        self._failures = 0
+        self._successes = 0
+
+    def _record_latency(self, seconds: float):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency = self._ewma_alpha * seconds + (1 - self._ewma_alpha) * self.latency
+
+    def record_success(self, seconds: float):
+        self._record_latency(seconds)
+        self.requests += 1
+        self._failures = 0
+
+    def record_failure(self, error):
+        self.errors += 1
+        self.last_error = str(error)
+        self._failures += 1
+        self._successes = 0
+        if self.healthy and self._failures >= self._max_failures:
+            self.healthy = False
+            log.warning(f'Ejected redis replica {self.name}: {error}')
+
+    def record_probe(self, seconds: float, lag: float | None, max_lag: float):
+        self._record_latency(seconds)
+        self.lag = lag
+        if lag is not None and lag > max_lag:
+            self._successes = 0
+            self.last_error = f'Replication lag of {lag}s'
+            if self.healthy:
+                self.healthy = False
+                log.warning(f'Ejected redis replica {self.name}: {self.last_error}')
+            return
+
+        self._failures = 0
+        if not self.healthy:
+            self._successes += 1
+            if self._successes >= self._readmit_after:
+                self.healthy = True
+                self._successes = 0
+                log.info(f'Readmitted redis replica {self.name}')
+
+    def get_stats(self) -> dict:
+        return {
+            'server': self.name,
+            'healthy': self.healthy,
+            'latency_ms': None if self.latency is None else round(self.latency * 1000, 3),
+            'lag': self.lag,
+            'requests': self.requests,
+            'errors': self.errors,
+            'last_error': self.last_error,
+        }
+
+
+# Deletes a lock only if it is still held by the caller so that a lock that
+# expired and was taken by another process is not released by mistake
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class HashRing:
+    """
+        Consistent hash ring of server indexes. Each server is placed on the
+        ring many times (virtual nodes) so that keys are spread evenly and
+        adding or removing a server only moves about 1/N of the keys.
+    """
+    def __init__(self, servers: list[str], virtual_nodes: int = 160):
+        points = []
+        for index, server in enumerate(servers):
+            # Credentials are left out so that changing a password does not
+            # move keys to other servers
+            name = get_server_name(server)
+            for i in range(virtual_nodes):
+                points.append((self._hash(f'{name}#{i}'), index))
+        points.sort()
+        self._hashes = [point[0] for point in points]
+        self._indexes = [point[1] for point in points]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+    def get_index(self, key: str) -> int:
+        position = bisect.bisect(self._hashes, self._hash(key))
+        return self._indexes[position % len(self._indexes)]
 
 
 class RedisCacheClient:
@@ -34,6 +413,21 @@ class RedisCacheClient:
         serializer=None,
         pool_class=None,
         parser_class=None,
+        compressor=None,
+        compress_min_length=1024,
+        near_cache_size=0,
+        near_cache_ttl=5,
+        near_cache_channel='django-cache:near-cache',
+        sharded=False,
+        virtual_nodes=160,
+        health_check_interval=5,
+        max_replica_lag=30,
+        replica_max_failures=3,
+        replica_readmit_after=2,
+        latency_ewma_alpha=0.2,
+        clear_batch_size=1000,
+        clear_pause=0,
+        metrics=None,
         **options,
     ):
         import redis
@@ -49,10 +443,14 @@ class RedisCacheClient:
         self._pool_class = pool_class or self._lib.ConnectionPool
 
         if isinstance(serializer, str):
-            serializer = import_string(serializer)
+            serializer = SERIALIZERS.get(serializer) or import_string(serializer)
         if callable(serializer):
             serializer = serializer()
         self._serializer = serializer or RedisSerializer()
+        if compressor:
+            self._serializer = CompressedSerializer(
+                self._serializer, compressor, compress_min_length
+            )
 
         if isinstance(parser_class, str):
             parser_class = import_string(parser_class)
@@ -60,15 +458,260 @@ class RedisCacheClient:
 
         self._pool_options = {"parser_class": parser_class, **options}
 
-    def _get_connection_pool_index(self, write):
+        # redis.asyncio pools are bound to the event loop they were created in
+        # and use their own parser classes
+        self._async_pools = WeakKeyDictionary()
+        self._async_pool_options = options
+
+        # In sharded mode all servers are primaries and each key lives on the
+        # server picked by the hash ring. Multi-key operations are split per
+        # server and run concurrently.
+        self._ring = HashRing(servers, virtual_nodes) if sharded else None
+        self._executor = None
+        self._executor_pid = None
+
+        # Optional in-memory cache in front of redis. Writes are published to
+        # near_cache_channel so that all processes drop their stale copies.
+        self._near_cache = None
+        if near_cache_size:
+            self._near_cache = NearCache(near_cache_size, near_cache_ttl)
+        self._near_cache_channel = near_cache_channel
+        self._near_cache_pid = None
+        self._near_cache_lock = threading.Lock()
+
+        # Reads are spread over the replicas weighted by their recent latency.
+        # Unhealthy replicas are skipped and reads go to the primary when none
+        # is left.
+        self._replicas = None
+        if not sharded and len(servers) > 1:
+            self._replicas = {
+                index: ReplicaHealth(
+                    get_server_name(servers[index]),
+                    latency_ewma_alpha,
+                    replica_max_failures,
+                    replica_readmit_after,
+                )
+                for index in range(1, len(servers))
+            }
+        self._health_check_interval = health_check_interval
+        self._max_replica_lag = max_replica_lag
+        self._health_check_pid = None
+        self._health_check_lock = threading.Lock()
+
+        self._clear_batch_size = clear_batch_size
+        self._clear_pause = clear_pause
+
+        self._metrics = metrics
+
+    def _dumps(self, key, value):
+        value = self._serializer.dumps(value)
+        if self._metrics is not None:
+            self._metrics.observe_size(key, value)
+        return value
+
+    def _start_health_checks(self):
+        # The probe thread does not survive a fork so each gunicorn worker
+        # starts its own on first use
+        pid = os.getpid()
+        if self._health_check_pid == pid:
+            return
+        with self._health_check_lock:
+            if self._health_check_pid == pid:
+                return
+            self._health_check_pid = pid
+            thread = threading.Thread(
+                target=self._check_replicas, name='redis-replica-health', daemon=True
+            )
+            thread.start()
+
+    def _check_replicas(self):
+        while True:
+            for index, replica in self._replicas.items():
+                client = self._client(connection_pool=self._get_connection_pool_by_index(index))
+                start = time.perf_counter()
+                try:
+                    info = client.info('replication')
+                except Exception as e:
+                    replica.record_failure(e)
+                    continue
+                replica.record_probe(
+                    time.perf_counter() - start,
+                    self._get_replication_lag(info),
+                    self._max_replica_lag,
+                )
+            time.sleep(self._health_check_interval)
+
+    @staticmethod
+    def _get_replication_lag(info: dict) -> float | None:
+        # An idle primary is only heard from every repl-ping-replica-period
+        # (10s by default), so max_replica_lag must be well above it
+        if info.get('role') != 'slave':
+            return None
+        if info.get('master_link_status') != 'up':
+            return float('inf')
+        return info.get('master_last_io_seconds_ago', 0)
+
+    def _select_replica(self) -> int:
+        self._start_health_checks()
+        indexes = []
+        weights = []
+        for index, replica in self._replicas.items():
+            if replica.healthy:
+                indexes.append(index)
+                # Replicas without measurements yet get the best weight
+                weights.append(1 / max(replica.latency or 0, 0.0001))
+        if not indexes:
+            return 0
+        return random.choices(indexes, weights)[0]
+
+    def _read(self, key, func):
+        """
+            Runs func(client) on the server to read key from. If a replica
+            fails, it is recorded and the read is retried on the primary.
+        """
+        index = self._get_connection_pool_index(False, key)
+        client = self._client(connection_pool=self._get_connection_pool_by_index(index))
+        if self._replicas is None or index == 0:
+            return func(client)
+
+        replica = self._replicas[index]
+        start = time.perf_counter()
+        try:
+            ret = func(client)
+        except (self._lib.ConnectionError, self._lib.TimeoutError) as e:
+            replica.record_failure(e)
+            return func(self.get_client(key, write=True))
+        replica.record_success(time.perf_counter() - start)
+        return ret
+
+    def get_server_stats(self) -> list[dict]:
+        """ Health and latency of each read replica """
+        if self._replicas is None:
+            return []
+        return [replica.get_stats() for replica in self._replicas.values()]
+
+    def _start_near_cache_listener(self):
+        # The listener thread does not survive a fork so each gunicorn worker
+        # starts its own on first use
+        pid = os.getpid()
+        if self._near_cache_pid == pid:
+            return
+        with self._near_cache_lock:
+            if self._near_cache_pid == pid:
+                return
+            self._near_cache.active = False
+            self._near_cache.clear()
+            self._near_cache_pid = pid
+            thread = threading.Thread(
+                target=self._listen_near_cache_invalidations,
+                name='near-cache-invalidation',
+                daemon=True,
+            )
+            thread.start()
+
+    def _listen_near_cache_invalidations(self):
+        near_cache = self._near_cache
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.get_client(None, write=True).pubsub(
+                    ignore_subscribe_messages=True
+                )
+                pubsub.subscribe(self._near_cache_channel)
+                near_cache.clear()
+                near_cache.active = True
+                for message in pubsub.listen():
+                    data = message['data']
+                    if data == b'*':
+                        near_cache.clear()
+                    else:
+                        near_cache.invalidate(json.loads(data))
+            except Exception as e:
+                log.warning(f'Near cache invalidation listener disconnected: {e}')
+            finally:
+                # Invalidations may have been missed while disconnected
+                near_cache.active = False
+                near_cache.clear()
+                if pubsub is not None:
+                    pubsub.close()
+            time.sleep(1)
+
+    def _invalidate_near_cache(self, keys):
+        if self._near_cache is None:
+            return
+        keys = list(keys)
+        self._near_cache.invalidate(keys)
+        self.get_client(None, write=True).publish(self._near_cache_channel, json.dumps(keys))
+
+    def _get_near(self, key, default):
+        near_cache = self._near_cache
+        self._start_near_cache_listener()
+        found, value = near_cache.get(key)
+        if not found:
+            generation = near_cache.generation
+
+            def fetch(client):
+                pipeline = client.pipeline(transaction=False)
+                pipeline.get(key)
+                pipeline.pttl(key)
+                return pipeline.execute()
+
+            value, pttl = self._read(key, fetch)
+            if value is None:
+                return default
+            near_cache.set(key, value, pttl / 1000 if pttl > 0 else None, generation)
+        return self._serializer.loads(value)
+
+    def _get_many_near(self, keys):
+        near_cache = self._near_cache
+        self._start_near_cache_listener()
+        values = {}
+        missing = []
+        for key in keys:
+            found, value = near_cache.get(key)
+            if found:
+                values[key] = value
+            else:
+                missing.append(key)
+
+        def fetch(client, shard_keys):
+            pipeline = client.pipeline(transaction=False)
+            pipeline.mget(shard_keys)
+            for key in shard_keys:
+                pipeline.pttl(key)
+            return pipeline.execute()
+
+        if missing:
+            generation = near_cache.generation
+            for shard_keys, (ret, *pttls) in self._map_shards(missing, fetch):
+                for key, value, pttl in zip(shard_keys, ret, pttls):
+                    if value is not None:
+                        values[key] = value
+                        near_cache.set(key, value, pttl / 1000 if pttl > 0 else None, generation)
+
+        return {k: self._serializer.loads(v) for k, v in values.items()}
+
+    def get_near_cache_stats(self) -> dict | None:
+        if self._near_cache is None:
+            return None
+        return self._near_cache.get_stats()
+
+    def _get_connection_pool_index(self, write, key=None):
+        # In sharded mode, the key decides the server. Keys are not given for
+        # operations that are not tied to a key which use the first server.
+        if self._ring is not None:
+            return 0 if key is None else self._ring.get_index(key)
         # Write to the first server. Read from other servers if there are more,
         # otherwise read from the first server.
         if write or len(self._servers) == 1:
             return 0
-        return random.randint(1, len(self._servers) - 1)
+        return self._select_replica()
+
+    def _get_connection_pool(self, write, key=None):
+        index = self._get_connection_pool_index(write, key)
+        return self._get_connection_pool_by_index(index)
 
-    def _get_connection_pool(self, write):
-        index = self._get_connection_pool_index(write)
+    def _get_connection_pool_by_index(self, index):
         if index not in self._pools:
             self._pools[index] = self._pool_class.from_url(
                 self._servers[index],
@@ -80,35 +723,134 @@ class RedisCacheClient:
         # key is used so that the method signature remains the same and custom
         # cache client can be implemented which might require the key to select
         # the server, e.g. sharding.
-        pool = self._get_connection_pool(write)
+        pool = self._get_connection_pool(write, key)
         return self._client(connection_pool=pool)
 
+    def _get_executor(self):
+        # Threads do not survive a fork so each gunicorn worker creates its own
+        pid = os.getpid()
+        if self._executor_pid != pid:
+            self._executor = ThreadPoolExecutor(
+                max_workers=len(self._servers), thread_name_prefix='redis-shard'
+            )
+            self._executor_pid = pid
+        return self._executor
+
+    def _map_shards(self, keys, func, write=False) -> list[tuple[list, Any]]:
+        """
+            Calls func(client, keys) once per server holding any of the keys
+            and returns a list of (keys, result). Servers are called
+            concurrently when the keys span more than one.
+        """
+        keys = list(keys)
+        if self._ring is None:
+            if write:
+                return [(keys, func(self.get_client(None, write=True), keys))]
+            return [(keys, self._read(None, lambda client: func(client, keys)))]
+
+        groups = {}
+        for key in keys:
+            groups.setdefault(self._ring.get_index(key), []).append(key)
+
+        def call(index, shard_keys):
+            client = self._client(connection_pool=self._get_connection_pool_by_index(index))
+            return shard_keys, func(client, shard_keys)
+
+        if len(groups) == 1:
+            return [call(*groups.popitem())]
+        executor = self._get_executor()
+        futures = [executor.submit(call, index, shard_keys) for index, shard_keys in groups.items()]
+        return [future.result() for future in futures]
+
     def add(self, key, value, timeout):
         client = self.get_client(key, write=True)
-        value = self._serializer.dumps(value)
 
         if timeout == 0:
-            if ret := bool(client.set(key, value, nx=True)):
-                client.delete(key)
-            return ret
+            # The key would be deleted right after adding it so there is
+            # nothing to write. It could only have been added if it is missing.
+            return not client.exists(key)
         else:
-            return bool(client.set(key, value, ex=timeout, nx=True))
+            value = self._dumps(key, value)
+            ret = bool(client.set(key, value, ex=timeout, nx=True))
+            if ret:
+                self._invalidate_near_cache([key])
+            return ret
 
     def get(self, key, default):
-        client = self.get_client(key)
-        value = client.get(key)
+        if self._near_cache is not None:
+            return self._get_near(key, default)
+        value = self._read(key, lambda client: client.get(key))
         return default if value is None else self._serializer.loads(value)
 
-    def set(self, key, value, timeout):
+    def set(self, key, value, timeout, tag_keys=None):
         client = self.get_client(key, write=True)
-        value = self._serializer.dumps(value)
+        value = self._dumps(key, value)
         if timeout == 0:
             client.delete(key)
         else:
             client.set(key, value, ex=timeout)
+            if tag_keys:
+                self._add_to_tags([key], tag_keys, timeout)
+        self._invalidate_near_cache([key])
+
+    def _add_to_tags(self, keys, tag_keys, timeout):
+        """
+            Records keys as members of each tag set. A tag set lives at least
+            as long as its longest lived key.
+        """
+        def add_to_shard(client, shard_tag_keys):
+            pipeline = client.pipeline(transaction=False)
+            for tag_key in shard_tag_keys:
+                for start in range(0, len(keys), ADD_TO_TAG_BATCH_SIZE):
+                    pipeline.eval(
+                        ADD_TO_TAG_SCRIPT,
+                        1,
+                        tag_key,
+                        -1 if timeout is None else timeout,
+                        *keys[start:start + ADD_TO_TAG_BATCH_SIZE],
+                    )
+            pipeline.execute()
+
+        self._map_shards(tag_keys, add_to_shard, write=True)
+
+    def invalidate_tags(self, tag_keys, batch_size=500) -> int:
+        """
+            Deletes every key recorded in the tag sets in batches of
+            batch_size and returns how many were deleted.
+        """
+        deleted = 0
+        for tag_key in tag_keys:
+            client = self.get_client(tag_key, write=True)
+            # Move the set aside first so that keys tagged while this runs are
+            # recorded in a new set and are not lost
+            pending_key = f'{tag_key}:invalidating:{uuid.uuid4().hex}'
+            try:
+                client.rename(tag_key, pending_key)
+            except self._lib.ResponseError:
+                # The tag has no keys
+                continue
+
+            batch = []
+            for member in client.sscan_iter(pending_key, count=batch_size):
+                batch.append(member.decode('utf-8'))
+                if len(batch) >= batch_size:
+                    deleted += self._delete_batch(batch)
+                    batch = []
+            if batch:
+                deleted += self._delete_batch(batch)
+            client.delete(pending_key)
+        return deleted
+
+    def _delete_batch(self, keys) -> int:
+        ret = self._map_shards(
+            keys, lambda client, shard_keys: client.delete(*shard_keys), write=True
+        )
+        self._invalidate_near_cache(keys)
+        return sum(count for _, count in ret)
 
     def touch(self, key, timeout):
         client = self.get_client(key, write=True)
+        self._invalidate_near_cache([key])
         if timeout is None:
             return bool(client.persist(key))
         else:
@@ -116,44 +858,436 @@ class RedisCacheClient:
 
     def delete(self, key):
         client = self.get_client(key, write=True)
-        return bool(client.delete(key))
+        ret = bool(client.delete(key))
+        self._invalidate_near_cache([key])
+        return ret
 
     def get_many(self, keys):
-        client = self.get_client(None)
-        ret = client.mget(keys)
-        return {
-            k: self._serializer.loads(v) for k, v in zip(keys, ret) if v is not None
-        }
+        if self._near_cache is not None:
+            return self._get_many_near(keys)
+        ret = {}
+        for shard_keys, values in self._map_shards(keys, lambda client, shard_keys: client.mget(shard_keys)):
+            ret.update(
+                (k, self._serializer.loads(v)) for k, v in zip(shard_keys, values) if v is not None
+            )
+        return ret
 
     def has_key(self, key):
-        client = self.get_client(key)
-        return bool(client.exists(key))
+        return bool(self._read(key, lambda client: client.exists(key)))
 
     def incr(self, key, delta):
         client = self.get_client(key, write=True)
-        if not client.exists(key):
+        ret = client.eval(INCR_IF_EXISTS_SCRIPT, 1, key, delta)
+        if ret is None:
             raise ValueError("Key '%s' not found." % key)
-        return client.incr(key, delta)
+        self._invalidate_near_cache([key])
+        return ret
 
-    def set_many(self, data, timeout):
-        client = self.get_client(None, write=True)
-        pipeline = client.pipeline()
-        pipeline.mset({k: self._serializer.dumps(v) for k, v in data.items()})
+    def set_many(self, data, timeout, tag_keys=None):
+        if timeout == 0:
+            self.delete_many(data.keys())
+            return
 
-        if timeout is not None:
-            # Setting timeout for each key as redis does not support timeout
-            # with mset().
-            for key in data:
-                pipeline.expire(key, timeout)
-        pipeline.execute()
+        def set_shard(client, shard_keys):
+            if timeout is None:
+                client.mset({k: self._dumps(k, data[k]) for k in shard_keys})
+                return
+            # SET with EX per key instead of MSET followed by an EXPIRE per key
+            # as redis does not support timeout with mset()
+            pipeline = client.pipeline()
+            for key in shard_keys:
+                pipeline.set(key, self._dumps(key, data[key]), ex=timeout)
+            pipeline.execute()
+
+        self._map_shards(data.keys(), set_shard, write=True)
+        if tag_keys:
+            self._add_to_tags(list(data.keys()), tag_keys, timeout)
+        self._invalidate_near_cache(data.keys())
+
+    def get_or_set_many(self, data, timeout):
+        """
+            Returns the values of all keys in data, storing the default in data
+            for the keys that are missing. Callable defaults are only called for
+            missing keys, which needs a get_many() first. Otherwise it takes a
+            single round trip per server.
+        """
+        values = {}
+        missing = data
+        if any(callable(default) for default in data.values()):
+            values = self.get_many(data.keys())
+            missing = {
+                k: default() if callable(default) else default
+                for k, default in data.items() if k not in values
+            }
+
+        if not missing:
+            return values
+        if timeout == 0:
+            # Nothing is stored as it would expire right away
+            return {**values, **missing}
+
+        def get_or_set_shard(client, shard_keys):
+            # SET NX GET returns the existing value or nil if it was set
+            pipeline = client.pipeline(transaction=False)
+            for key in shard_keys:
+                pipeline.set(
+                    key, self._dumps(key, missing[key]), ex=timeout, nx=True, get=True
+                )
+            return pipeline.execute()
+
+        added = []
+        for shard_keys, ret in self._map_shards(missing.keys(), get_or_set_shard, write=True):
+            for key, value in zip(shard_keys, ret):
+                if value is None:
+                    values[key] = missing[key]
+                    added.append(key)
+                else:
+                    values[key] = self._serializer.loads(value)
+        self._invalidate_near_cache(added)
+        return values
+
+    def incr_many(self, data):
+        """
+            Increments each existing key in data by its delta. Returns the new
+            values. Missing keys are left out like in get_many().
+        """
+        def incr_shard(client, shard_keys):
+            pipeline = client.pipeline(transaction=False)
+            for key in shard_keys:
+                pipeline.eval(INCR_IF_EXISTS_SCRIPT, 1, key, data[key])
+            return pipeline.execute()
+
+        values = {}
+        for shard_keys, ret in self._map_shards(data.keys(), incr_shard, write=True):
+            values.update((k, v) for k, v in zip(shard_keys, ret) if v is not None)
+        self._invalidate_near_cache(values.keys())
+        return values
+
+    def touch_many(self, keys, timeout):
+        """ Returns whether each key was touched """
+        def touch_shard(client, shard_keys):
+            pipeline = client.pipeline(transaction=False)
+            for key in shard_keys:
+                if timeout is None:
+                    pipeline.persist(key)
+                else:
+                    pipeline.expire(key, timeout)
+            return pipeline.execute()
+
+        ret = {}
+        for shard_keys, touched in self._map_shards(keys, touch_shard, write=True):
+            ret.update((k, bool(t)) for k, t in zip(shard_keys, touched))
+        self._invalidate_near_cache(ret.keys())
+        return ret
+
+    def acquire_lock(self, key, token: str, timeout: float) -> bool:
+        client = self.get_client(key, write=True)
+        return bool(client.set(key, token, px=int(timeout * 1000), nx=True))
+
+    def release_lock(self, key, token: str) -> bool:
+        client = self.get_client(key, write=True)
+        return bool(client.eval(RELEASE_LOCK_SCRIPT, 1, key, token))
 
     def delete_many(self, keys):
-        client = self.get_client(None, write=True)
-        client.delete(*keys)
+        self._map_shards(keys, lambda client, shard_keys: client.delete(*shard_keys), write=True)
+        self._invalidate_near_cache(keys)
 
-    def clear(self):
-        client = self.get_client(None, write=True)
-        return bool(client.flushdb())
+    def _get_all_write_indexes(self):
+        if self._ring is None:
+            return [0]
+        return range(len(self._servers))
+
+    def clear(self, pattern='*', batch_size=None, pause=None, progress=None) -> int:
+        """
+            Deletes the keys matching pattern with SCAN and UNLINK in batches
+            of batch_size, sleeping pause seconds between batches so that
+            redis is never blocked. Unlike FLUSHDB, it leaves other data in
+            the same db such as RQ queues. progress is called with the number
+            of keys deleted so far after each batch.
+            Returns the number of keys deleted.
+        """
+        batch_size = batch_size or self._clear_batch_size
+        pause = self._clear_pause if pause is None else pause
+        deleted = 0
+        for index in self._get_all_write_indexes():
+            client = self._client(connection_pool=self._get_connection_pool_by_index(index))
+            batch = []
+            for key in client.scan_iter(match=pattern, count=batch_size):
+                batch.append(key)
+                if len(batch) >= batch_size:
+                    deleted += client.unlink(*batch)
+                    batch = []
+                    if progress:
+                        progress(deleted)
+                    if pause:
+                        time.sleep(pause)
+            if batch:
+                deleted += client.unlink(*batch)
+                if progress:
+                    progress(deleted)
+
+        if self._near_cache is not None:
+            self._near_cache.clear()
+            self.get_client(None, write=True).publish(self._near_cache_channel, '*')
+        return deleted
+
+    @cached_property
+    def _async_pool_class(self):
+        """ The redis.asyncio counterpart of pool_class """
+        import redis.asyncio
+
+        async_pool_classes = {
+            self._lib.ConnectionPool: redis.asyncio.ConnectionPool,
+            self._lib.BlockingConnectionPool: redis.asyncio.BlockingConnectionPool,
+        }
+        if self._pool_class not in async_pool_classes:
+            raise ImproperlyConfigured(
+                f'The async cache methods do not support pool_class {self._pool_class.__name__}'
+            )
+        return async_pool_classes[self._pool_class]
+
+    def _get_async_connection_pool_by_index(self, index):
+        pools = self._async_pools.setdefault(asyncio.get_running_loop(), {})
+        if index not in pools:
+            pools[index] = self._async_pool_class.from_url(
+                self._servers[index],
+                **self._async_pool_options,
+            )
+        return pools[index]
+
+    def get_async_client(self, key=None, *, write=False):
+        import redis.asyncio
+
+        index = self._get_connection_pool_index(write, key)
+        pool = self._get_async_connection_pool_by_index(index)
+        return redis.asyncio.Redis(connection_pool=pool)
+
+    async def _aread(self, key, func):
+        """ Async version of _read() """
+        import redis.asyncio
+
+        index = self._get_connection_pool_index(False, key)
+        client = redis.asyncio.Redis(
+            connection_pool=self._get_async_connection_pool_by_index(index)
+        )
+        if self._replicas is None or index == 0:
+            return await func(client)
+
+        replica = self._replicas[index]
+        start = time.perf_counter()
+        try:
+            ret = await func(client)
+        except (self._lib.ConnectionError, self._lib.TimeoutError) as e:
+            replica.record_failure(e)
+            return await func(self.get_async_client(key, write=True))
+        replica.record_success(time.perf_counter() - start)
+        return ret
+
+    async def _amap_shards(self, keys, func, write=False) -> list[tuple[list, Any]]:
+        """ Async version of _map_shards(). Servers are awaited concurrently """
+        import redis.asyncio
+
+        keys = list(keys)
+        if self._ring is None:
+            if write:
+                return [(keys, await func(self.get_async_client(None, write=True), keys))]
+            return [(keys, await self._aread(None, lambda client: func(client, keys)))]
+
+        groups = {}
+        for key in keys:
+            groups.setdefault(self._ring.get_index(key), []).append(key)
+
+        async def call(index, shard_keys):
+            client = redis.asyncio.Redis(
+                connection_pool=self._get_async_connection_pool_by_index(index)
+            )
+            return shard_keys, await func(client, shard_keys)
+
+        return await asyncio.gather(
+            *(call(index, shard_keys) for index, shard_keys in groups.items())
+        )
+
+    async def _ainvalidate_near_cache(self, keys):
+        if self._near_cache is None:
+            return
+        keys = list(keys)
+        self._near_cache.invalidate(keys)
+        client = self.get_async_client(None, write=True)
+        await client.publish(self._near_cache_channel, json.dumps(keys))
+
+    async def aadd(self, key, value, timeout):
+        client = self.get_async_client(key, write=True)
+
+        if timeout == 0:
+            return not await client.exists(key)
+        else:
+            value = self._dumps(key, value)
+            ret = bool(await client.set(key, value, ex=timeout, nx=True))
+            if ret:
+                await self._ainvalidate_near_cache([key])
+            return ret
+
+    async def aget(self, key, default):
+        near_cache = self._near_cache
+        if near_cache is None:
+            value = await self._aread(key, lambda client: client.get(key))
+            return default if value is None else self._serializer.loads(value)
+
+        self._start_near_cache_listener()
+        found, value = near_cache.get(key)
+        if not found:
+            generation = near_cache.generation
+
+            async def fetch(client):
+                pipeline = client.pipeline(transaction=False)
+                pipeline.get(key)
+                pipeline.pttl(key)
+                return await pipeline.execute()
+
+            value, pttl = await self._aread(key, fetch)
+            if value is None:
+                return default
+            near_cache.set(key, value, pttl / 1000 if pttl > 0 else None, generation)
+        return self._serializer.loads(value)
+
+    async def aset(self, key, value, timeout):
+        client = self.get_async_client(key, write=True)
+        value = self._dumps(key, value)
+        if timeout == 0:
+            await client.delete(key)
+        else:
+            await client.set(key, value, ex=timeout)
+        await self._ainvalidate_near_cache([key])
+
+    async def atouch(self, key, timeout):
+        client = self.get_async_client(key, write=True)
+        await self._ainvalidate_near_cache([key])
+        if timeout is None:
+            return bool(await client.persist(key))
+        else:
+            return bool(await client.expire(key, timeout))
+
+    async def adelete(self, key):
+        client = self.get_async_client(key, write=True)
+        ret = bool(await client.delete(key))
+        await self._ainvalidate_near_cache([key])
+        return ret
+
+    async def aget_many(self, keys):
+        # The near cache is only used by the sync get_many()
+        ret = {}
+        for shard_keys, values in await self._amap_shards(
+            keys, lambda client, shard_keys: client.mget(shard_keys)
+        ):
+            ret.update(
+                (k, self._serializer.loads(v)) for k, v in zip(shard_keys, values) if v is not None
+            )
+        return ret
+
+    async def ahas_key(self, key):
+        return bool(await self._aread(key, lambda client: client.exists(key)))
+
+    async def aincr(self, key, delta):
+        client = self.get_async_client(key, write=True)
+        ret = await client.eval(INCR_IF_EXISTS_SCRIPT, 1, key, delta)
+        if ret is None:
+            raise ValueError("Key '%s' not found." % key)
+        await self._ainvalidate_near_cache([key])
+        return ret
+
+    async def aset_many(self, data, timeout):
+        if timeout == 0:
+            await self.adelete_many(data.keys())
+            return
+
+        async def set_shard(client, shard_keys):
+            if timeout is None:
+                await client.mset({k: self._dumps(k, data[k]) for k in shard_keys})
+                return
+            pipeline = client.pipeline()
+            for key in shard_keys:
+                pipeline.set(key, self._dumps(key, data[key]), ex=timeout)
+            await pipeline.execute()
+
+        await self._amap_shards(data.keys(), set_shard, write=True)
+        await self._ainvalidate_near_cache(data.keys())
+
+    async def adelete_many(self, keys):
+        await self._amap_shards(
+            keys, lambda client, shard_keys: client.delete(*shard_keys), write=True
+        )
+        await self._ainvalidate_near_cache(keys)
+
+    async def aclear(self, pattern='*', batch_size=None, pause=None) -> int:
+        """ Async version of clear() """
+        import redis.asyncio
+
+        batch_size = batch_size or self._clear_batch_size
+        pause = self._clear_pause if pause is None else pause
+        deleted = 0
+        for index in self._get_all_write_indexes():
+            client = redis.asyncio.Redis(
+                connection_pool=self._get_async_connection_pool_by_index(index)
+            )
+            batch = []
+            async for key in client.scan_iter(match=pattern, count=batch_size):
+                batch.append(key)
+                if len(batch) >= batch_size:
+                    deleted += await client.unlink(*batch)
+                    batch = []
+                    if pause:
+                        await asyncio.sleep(pause)
+            if batch:
+                deleted += await client.unlink(*batch)
+
+        if self._near_cache is not None:
+            self._near_cache.clear()
+            await self.get_async_client(None, write=True).publish(self._near_cache_channel, '*')
+        return deleted
+
+
+# Default for get() when metrics are enabled, to tell hits from misses
+_MISSING = object()
+
+
+def timed(operation: str):
+    """
+        Records the latency of a RedisCache method when metrics are enabled,
+        and in the trace of the request when it is traced
+    """
+    def observe(metrics, trace, seconds: float):
+        if metrics is not None:
+            metrics.observe_latency(operation, seconds)
+        if trace is not None:
+            trace.record('cache', seconds)
+
+    def decorator(method):
+        if asyncio.iscoroutinefunction(method):
+            @wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                trace = current_trace.get()
+                if self._metrics is None and trace is None:
+                    return await method(self, *args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await method(self, *args, **kwargs)
+                finally:
+                    observe(self._metrics, trace, time.perf_counter() - start)
+            return async_wrapper
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            trace = current_trace.get()
+            if self._metrics is None and trace is None:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                observe(self._metrics, trace, time.perf_counter() - start)
+        return wrapper
+
+    return decorator
 
 
 class RedisCache(BaseCache):
@@ -165,11 +1299,21 @@ class RedisCache(BaseCache):
             self._servers = server
 
         self._class = RedisCacheClient
-        self._options = params.get("OPTIONS", {})
+        self._options = dict(params.get("OPTIONS", {}))
+
+        self._metrics = None
+        if self._options.pop('metrics', False):
+            self._metrics = CacheMetrics(
+                log_interval=self._options.pop('metrics_log_interval', 60)
+            )
+        self._options.pop('metrics_log_interval', None)
 
     @cached_property
     def _cache(self):
-        return self._class(self._servers, **self._options)
+        return self._class(self._servers, metrics=self._metrics, **self._options)
+
+    def get_metrics(self) -> CacheMetrics | None:
+        return self._metrics
 
     def get_backend_timeout(self, timeout=DEFAULT_TIMEOUT):
         if timeout == DEFAULT_TIMEOUT:
@@ -178,56 +1322,332 @@ class RedisCache(BaseCache):
         # Non-positive values will cause the key to be deleted.
         return None if timeout is None else max(0, int(timeout))
 
+    @timed('add')
     def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
         key = self.make_and_validate_key(key, version=version)
         return self._cache.add(key, value, self.get_backend_timeout(timeout))
 
+    @timed('get')
     def get(self, key, default=None, version=None):
-        key = self.make_and_validate_key(key, version=version)
-        return self._cache.get(key, default)
+        cache_key = self.make_and_validate_key(key, version=version)
+        if self._metrics is None:
+            return self._cache.get(cache_key, default)
+        value = self._cache.get(cache_key, _MISSING)
+        self._metrics.observe_lookups([key], () if value is _MISSING else (key,))
+        return default if value is _MISSING else value
 
-    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+    @timed('set')
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, tags=None):
+        """ tags is an optional list of tag names to invalidate the key with """
         key = self.make_and_validate_key(key, version=version)
-        self._cache.set(key, value, self.get_backend_timeout(timeout))
+        self._cache.set(
+            key, value, self.get_backend_timeout(timeout), self._make_tag_keys(tags)
+        )
+
+    def _make_tag_keys(self, tags) -> list[str] | None:
+        # Tags do not depend on the key version
+        if not tags:
+            return None
+        return [self.make_and_validate_key(f'tag:{tag}') for tag in tags]
 
+    @timed('invalidate_tags')
+    def invalidate_tags(self, tags) -> int:
+        """
+            Deletes all keys set with any of the tags, e.g. the cached
+            listviews of a model after one of its objects is saved.
+            Returns the number of keys deleted.
+        """
+        if not tags:
+            return 0
+        return self._cache.invalidate_tags(self._make_tag_keys(tags))
+
+    @timed('touch')
     def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
         key = self.make_and_validate_key(key, version=version)
         return self._cache.touch(key, self.get_backend_timeout(timeout))
 
+    @timed('delete')
     def delete(self, key, version=None):
         key = self.make_and_validate_key(key, version=version)
         return self._cache.delete(key)
 
+    @timed('get_many')
     def get_many(self, keys, version=None):
         key_map = {
             self.make_and_validate_key(key, version=version): key for key in keys
         }
         ret = self._cache.get_many(key_map.keys())
-        return {key_map[k]: v for k, v in ret.items()}
+        ret = {key_map[k]: v for k, v in ret.items()}
+        if self._metrics is not None:
+            self._metrics.observe_lookups(key_map.values(), ret)
+        return ret
 
+    @timed('has_key')
     def has_key(self, key, version=None):
         key = self.make_and_validate_key(key, version=version)
         return self._cache.has_key(key)
 
+    @timed('incr')
     def incr(self, key, delta=1, version=None):
         key = self.make_and_validate_key(key, version=version)
         return self._cache.incr(key, delta)
 
-    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+    @timed('set_many')
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None, tags=None):
         if not data:
             return []
         safe_data = {}
         for key, value in data.items():
             key = self.make_and_validate_key(key, version=version)
             safe_data[key] = value
-        self._cache.set_many(safe_data, self.get_backend_timeout(timeout))
+        self._cache.set_many(
+            safe_data, self.get_backend_timeout(timeout), self._make_tag_keys(tags)
+        )
         return []
 
+    @timed('delete_many')
     def delete_many(self, keys, version=None):
         if not keys:
             return
         safe_keys = [self.make_and_validate_key(key, version=version) for key in keys]
         self._cache.delete_many(safe_keys)
 
-    def clear(self):
-        return self._cache.clear()
\ No newline at end of file
+    @timed('get_or_set_many')
+    def get_or_set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+            Batch version of get_or_set(). data maps each key to its default
+            which may be a callable.
+        """
+        if not data:
+            return {}
+        key_map = {
+            self.make_and_validate_key(key, version=version): key for key in data
+        }
+        safe_data = {k: data[key] for k, key in key_map.items()}
+        ret = self._cache.get_or_set_many(safe_data, self.get_backend_timeout(timeout))
+        return {key_map[k]: v for k, v in ret.items()}
+
+    @timed('incr_many')
+    def incr_many(self, data, version=None):
+        """ Batch version of incr(). data maps each key to its delta """
+        if not data:
+            return {}
+        key_map = {
+            self.make_and_validate_key(key, version=version): key for key in data
+        }
+        ret = self._cache.incr_many({k: data[key] for k, key in key_map.items()})
+        return {key_map[k]: v for k, v in ret.items()}
+
+    @timed('touch_many')
+    def touch_many(self, keys, timeout=DEFAULT_TIMEOUT, version=None):
+        if not keys:
+            return {}
+        key_map = {
+            self.make_and_validate_key(key, version=version): key for key in keys
+        }
+        ret = self._cache.touch_many(key_map.keys(), self.get_backend_timeout(timeout))
+        return {key_map[k]: v for k, v in ret.items()}
+
+    def _get_clear_pattern(self) -> str:
+        # All keys made by make_key() start with the key prefix. Glob special
+        # characters in the prefix are escaped.
+        prefix = re.sub(r'([*?\[\]\\])', r'\\\1', self.key_prefix)
+        return f'{prefix}:*'
+
+    def clear(self, batch_size=None, pause=None, progress=None) -> int:
+        """
+            Deletes only the keys of this cache (those under KEY_PREFIX) and
+            returns how many were deleted. See RedisCacheClient.clear()
+        """
+        return self._cache.clear(self._get_clear_pattern(), batch_size, pause, progress)
+
+    def get_or_set_protected(
+        self,
+        key,
+        default,
+        timeout=DEFAULT_TIMEOUT,
+        version=None,
+        stale_ttl=0,
+        beta=1.0,
+        lock_timeout=10,
+        wait_timeout=5,
+    ):
+        """
+            get_or_set() that keeps workers from recomputing an expired value
+            at the same time. default is a callable.
+            - Only the worker holding a short redis lock recomputes the value.
+              Others wait for it unless they can serve a stale value.
+            - stale_ttl keeps values for that many seconds past their timeout
+              so they can be served while one worker recomputes them.
+            - Values are recomputed before they expire with a probability
+              that grows as expiry nears and with how long they took to
+              compute (XFetch). beta > 1 favors earlier recomputation and 0
+              disables it.
+            Values are stored with their expiry so keys used here should not
+            be read with get().
+        """
+        timeout = self.get_backend_timeout(timeout)
+        cache_key = self.make_and_validate_key(key, version=version)
+        lock_key = self.make_and_validate_key(f'{key}:lock', version=version)
+
+        entry = self._cache.get(cache_key, None)
+        if entry is not None:
+            expires_at = entry['expires_at']
+            if expires_at is None:
+                return entry['value']
+            # XFetch: recompute early with a probability that grows with the
+            # compute time and as the expiry nears
+            early = entry['delta'] * beta * math.log(1 - random.random())
+            if time.time() - early < expires_at:
+                return entry['value']
+
+        token = uuid.uuid4().hex
+        if not self._cache.acquire_lock(lock_key, token, lock_timeout):
+            # Another worker is recomputing. Serve what we have if it is still
+            # fresh (early recomputation) or within stale_ttl.
+            if entry is not None and time.time() < entry['expires_at'] + stale_ttl:
+                return entry['value']
+
+            deadline = time.monotonic() + wait_timeout
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                entry = self._cache.get(cache_key, None)
+                if entry is not None and (
+                    entry['expires_at'] is None or time.time() < entry['expires_at']
+                ):
+                    return entry['value']
+            # The other worker is taking too long, compute it here as well
+            token = None
+
+        try:
+            start = time.time()
+            value = default()
+            now = time.time()
+            if timeout != 0:
+                self._cache.set(
+                    cache_key,
+                    {
+                        'value': value,
+                        'delta': now - start,
+                        'expires_at': None if timeout is None else now + timeout,
+                    },
+                    None if timeout is None else timeout + stale_ttl,
+                )
+            return value
+        finally:
+            if token is not None:
+                self._cache.release_lock(lock_key, token)
+
+    # Native async versions so that async views do not need a thread per call
+
+    @timed('aadd')
+    async def aadd(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return await self._cache.aadd(key, value, self.get_backend_timeout(timeout))
+
+    @timed('aget')
+    async def aget(self, key, default=None, version=None):
+        cache_key = self.make_and_validate_key(key, version=version)
+        if self._metrics is None:
+            return await self._cache.aget(cache_key, default)
+        value = await self._cache.aget(cache_key, _MISSING)
+        self._metrics.observe_lookups([key], () if value is _MISSING else (key,))
+        return default if value is _MISSING else value
+
+    @timed('aset')
+    async def aset(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        await self._cache.aset(key, value, self.get_backend_timeout(timeout))
+
+    @timed('atouch')
+    async def atouch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return await self._cache.atouch(key, self.get_backend_timeout(timeout))
+
+    @timed('adelete')
+    async def adelete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return await self._cache.adelete(key)
+
+    @timed('aget_many')
+    async def aget_many(self, keys, version=None):
+        key_map = {
+            self.make_and_validate_key(key, version=version): key for key in keys
+        }
+        ret = await self._cache.aget_many(key_map.keys())
+        ret = {key_map[k]: v for k, v in ret.items()}
+        if self._metrics is not None:
+            self._metrics.observe_lookups(key_map.values(), ret)
+        return ret
+
+    @timed('ahas_key')
+    async def ahas_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return await self._cache.ahas_key(key)
+
+    @timed('aincr')
+    async def aincr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return await self._cache.aincr(key, delta)
+
+    @timed('aset_many')
+    async def aset_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        if not data:
+            return []
+        safe_data = {}
+        for key, value in data.items():
+            key = self.make_and_validate_key(key, version=version)
+            safe_data[key] = value
+        await self._cache.aset_many(safe_data, self.get_backend_timeout(timeout))
+        return []
+
+    @timed('adelete_many')
+    async def adelete_many(self, keys, version=None):
+        if not keys:
+            return
+        safe_keys = [self.make_and_validate_key(key, version=version) for key in keys]
+        await self._cache.adelete_many(safe_keys)
+
+    async def aclear(self, batch_size=None, pause=None) -> int:
+        return await self._cache.aclear(self._get_clear_pattern(), batch_size, pause)
+
+    def get_near_cache_stats(self) -> dict | None:
+        """ Hit, miss and eviction counters of this process' near cache """
+        return self._cache.get_near_cache_stats()
+
+    def get_server_stats(self) -> list[dict]:
+        """ Health and latency of each read replica as seen by this process """
+        return self._cache.get_server_stats()
+
+
+def cached(
+    timeout=DEFAULT_TIMEOUT,
+    key_prefix: str | None = None,
+    cache_alias: str = 'default',
+    **options,
+):
+    """
+        Caches the result of a function per set of arguments using
+        RedisCache.get_or_set_protected(). Arguments must be json serializable,
+        others raise TypeError.
+        options are passed to get_or_set_protected() (stale_ttl, beta, ...).
+
+        @cached(timeout=60, stale_ttl=30)
+        def get_app_list(user_id): ...
+    """
+    def decorator(func):
+        prefix = key_prefix or f'{func.__module__}.{func.__qualname__}'
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            arguments = json.dumps([args, kwargs], sort_keys=True)
+            key = f'{prefix}:{hashlib.md5(arguments.encode("utf-8")).hexdigest()}'
+            cache = caches[cache_alias]
+            default = lambda: func(*args, **kwargs)  # noqa: E731
+            if not hasattr(cache, 'get_or_set_protected'):
+                return cache.get_or_set(key, default, timeout)
+            return cache.get_or_set_protected(key, default, timeout, **options)
+
+        return wrapper
+
+    return decorator
@@ -1,3 +1,9 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable
+
 import boto3
 from storages.backends.s3boto3 import S3Boto3Storage
 
@@ -8,6 +14,7 @@ from backend.settings.base import (
     AWS_STORAGE_BUCKET_NAME_PRIVATE,
     ENV,
 )
+from backend.settings.tracing import add_boto3_tracing
 
 if not ENV.application.use_local_s3:
     bucket = ''
@@ -19,7 +26,79 @@ else:
     access_key = AWS_ACCESS_KEY_ID
     secret_key = AWS_SECRET_ACCESS_KEY
     region = AWS_S3_REGION_NAME
-    
+
+# Seconds a presigned url is valid for
+URL_EXPIRES_IN = 60
+
+# Seconds before it expires after which a presigned url is no longer handed
+# out, so that it is still valid by the time the browser requests it
+URL_EXPIRY_MARGIN = 15
+
+# Max number of presigned urls kept per process
+URL_CACHE_SIZE = 10000
+
+
+class S3ClientCache:
+    """
+        One S3 client per process. Clients are thread safe but are recreated
+        in a forked process so that processes never share a connection pool.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client = None
+        self._pid = None
+
+    def get_client(self):
+        pid = os.getpid()
+        if self._client is None or self._pid != pid:
+            with self._lock:
+                if self._client is None or self._pid != pid:
+                    # boto3.client uses the default session which is not thread safe
+                    self._client = boto3.session.Session().client(
+                        's3',
+                        aws_access_key_id = access_key,
+                        aws_secret_access_key = secret_key,
+                        region_name = region
+                    )
+                    add_boto3_tracing(self._client)
+                    self._pid = pid
+        return self._client
+
+
+class PresignedUrlCache:
+    """ Presigned urls by bucket and name, least recently used are dropped first """
+    def __init__(self, max_size: int = URL_CACHE_SIZE):
+        self._max_size = max_size
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple[str, str], now: float) -> str | None:
+        with self._lock:
+            entry = self._urls.get(key)
+            if entry is None:
+                return None
+            url, expires_at = entry
+            if expires_at <= now:
+                del self._urls[key]
+                return None
+            self._urls.move_to_end(key)
+            return url
+
+    def set(self, key: tuple[str, str], url: str, expires_at: float):
+        with self._lock:
+            self._urls[key] = (url, expires_at)
+            self._urls.move_to_end(key)
+            while len(self._urls) > self._max_size:
+                self._urls.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._urls.clear()
+
+
+s3_clients = S3ClientCache()
+presigned_urls = PresignedUrlCache()
+
 
 class PrivateS3Boto3Storage(S3Boto3Storage):
     """
@@ -29,19 +108,41 @@ class PrivateS3Boto3Storage(S3Boto3Storage):
         kwargs['bucket_name'] = bucket
         super().__init__(*args, **kwargs)
 
+    @property
+    def connection(self):
+        connection = getattr(self._connections, 'connection', None)
+        if connection is None:
+            connection = super().connection
+            add_boto3_tracing(connection.meta.client)
+        return connection
+
     def url(self, name):
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id = access_key,
-            aws_secret_access_key = secret_key,
-            region_name = region
-        )
-
-        return s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': self.bucket_name, 'Key': f'media/{name}'},
-            ExpiresIn=60  # url expiration time in seconds
-        )
+        return self.bulk_url([name])[name]
+
+    def bulk_url(self, names: Iterable[str]) -> dict[str, str]:
+        """
+            Presigned urls by name. Urls are reused until URL_EXPIRY_MARGIN
+            seconds before they expire, e.g. for a serializer of a list view:
+            urls = storage.bulk_url(obj.file.name for obj in page)
+        """
+        ret = {}
+        s3_client = None
+        now = time.monotonic()
+        for name in names:
+            if name in ret:
+                continue
+            key = (self.bucket_name, name)
+            url = presigned_urls.get(key, now)
+            if url is None:
+                s3_client = s3_client or s3_clients.get_client()
+                url = s3_client.generate_presigned_url(
+                    'get_object',
+                    Params={'Bucket': self.bucket_name, 'Key': f'media/{name}'},
+                    ExpiresIn=URL_EXPIRES_IN
+                )
+                presigned_urls.set(key, url, now + URL_EXPIRES_IN - URL_EXPIRY_MARGIN)
+            ret[name] = url
+        return ret
     
 
 def get_private_storage():
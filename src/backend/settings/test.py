@@ -25,18 +25,20 @@ CACHES = {
     "default": {
         "BACKEND": "backend.settings.redis.RedisCache",
         "LOCATION": redis_location,
+        "OPTIONS": REDIS_CACHE_OPTIONS,
     },
 }
 
 RQ_QUEUES = {
-    'default': {
+    name: {
         'HOST': ENV.database.redis.host,
         'PORT': ENV.database.redis.port,
         'DB': ENV.database.redis.test_db_index,
         'USERNAME': ENV.database.redis.username,
         'PASSWORD': ENV.database.redis.password,
         'DEFAULT_TIMEOUT': 360,
-    },
+    }
+    for name in dict.fromkeys([*ENV.database.redis.rq_queues, 'default'])
 }
 
 
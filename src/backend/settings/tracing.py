@@ -0,0 +1,80 @@
+"""
+    Per request timings of database queries, cache calls and outbound http
+    requests, collected by backend.middleware.TracingMiddleware for the
+    requests it samples. Instrumented code records into the trace of the
+    request being handled, which costs a context variable lookup when the
+    request is not sampled.
+"""
+import time
+from contextvars import ContextVar
+
+from django.db.backends.signals import connection_created
+
+# Queries kept per trace for the slow request log
+MAX_CAPTURED_QUERIES = 500
+
+TRACE_KINDS = ('db', 'cache', 'http')
+
+
+class RequestTrace:
+    def __init__(self):
+        self.counts = dict.fromkeys(TRACE_KINDS, 0)
+        self.durations = dict.fromkeys(TRACE_KINDS, 0.0)
+        self.queries = []
+
+    def record(self, kind: str, seconds: float):
+        self.counts[kind] += 1
+        self.durations[kind] += seconds
+
+    def record_query(self, alias: str, sql: str, seconds: float):
+        self.record('db', seconds)
+        if len(self.queries) < MAX_CAPTURED_QUERIES:
+            self.queries.append({'alias': alias, 'sql': sql, 'ms': round(seconds * 1000, 3)})
+
+
+current_trace: ContextVar[RequestTrace | None] = ContextVar('current_trace', default=None)
+
+
+def record(kind: str, seconds: float):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.record(kind, seconds)
+
+
+def _trace_query(execute, sql, params, many, context):
+    trace = current_trace.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        trace.record_query(context['connection'].alias, sql, time.perf_counter() - start)
+
+
+def _start_aws_call(context: dict, **kwargs):
+    context['trace_started_at'] = time.perf_counter()
+
+
+def _end_aws_call(context: dict, **kwargs):
+    started_at = context.get('trace_started_at')
+    if started_at is not None:
+        record('http', time.perf_counter() - started_at)
+
+
+def add_boto3_tracing(client):
+    """ Records the api calls of a boto3 client as http requests """
+    client.meta.events.register('before-call', _start_aws_call)
+    client.meta.events.register('after-call', _end_aws_call)
+    client.meta.events.register('after-call-error', _end_aws_call)
+
+
+def _add_query_tracing(sender, connection, **kwargs):
+    # execute_wrappers outlive reconnects of the same connection
+    if _trace_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_trace_query)
+
+
+def install_query_tracing():
+    connection_created.connect(_add_query_tracing, dispatch_uid='backend.settings.tracing')
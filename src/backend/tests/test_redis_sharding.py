@@ -0,0 +1,119 @@
+import uuid
+
+import fakeredis
+import pytest
+
+from backend.settings.redis import HashRing, RedisCache
+
+KEYS = [f'key:{i}' for i in range(2000)]
+
+
+def get_servers(count: int) -> list[str]:
+    # fakeredis keeps one server per host and port, unique hosts keep tests apart
+    prefix = uuid.uuid4().hex[:8]
+    return [f'redis://{prefix}-shard{i}:6379/0' for i in range(count)]
+
+
+def get_placement(servers: list[str]) -> dict[str, str]:
+    ring = HashRing(servers)
+    return {key: servers[ring.get_index(key)] for key in KEYS}
+
+
+@pytest.fixture
+def servers():
+    return get_servers(3)
+
+
+@pytest.fixture
+def cache(servers):
+    return RedisCache(servers, {
+        'OPTIONS': {'sharded': True, 'connection_class': fakeredis.FakeRedisConnection},
+    })
+
+
+def get_shard_keys(servers: list[str]) -> dict[str, set]:
+    """ The cache keys stored on each server """
+    shard_keys = {}
+    for server in servers:
+        client = fakeredis.FakeRedis.from_url(server)
+        shard_keys[server] = {key.decode().split(':', 2)[2] for key in client.keys('*')}
+    return shard_keys
+
+
+def test_ring_uses_every_server(servers):
+    placement = get_placement(servers)
+    for server in servers:
+        assert list(placement.values()).count(server) > len(KEYS) / len(servers) / 2
+
+
+def test_ring_placement_is_stable():
+    servers = get_servers(3)
+    assert get_placement(servers) == get_placement(list(servers))
+
+
+def test_ring_ignores_credentials():
+    servers = get_servers(3)
+    with_credentials = [server.replace('redis://', 'redis://user:secret@') for server in servers]
+    placement = get_placement(servers)
+    for key, server in get_placement(with_credentials).items():
+        assert server.replace('user:secret@', '') == placement[key]
+
+
+def test_adding_a_server_only_moves_keys_to_it():
+    servers = get_servers(4)
+    before = get_placement(servers[:3])
+    after = get_placement(servers)
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert all(after[key] == servers[3] for key in moved)
+    # About 1/4 of the keys move to the new server
+    assert 0.15 < len(moved) / len(KEYS) < 0.35
+
+
+def test_removing_a_server_only_moves_its_keys():
+    servers = get_servers(4)
+    before = get_placement(servers)
+    after = get_placement(servers[:1] + servers[2:])
+    for key in KEYS:
+        if before[key] == servers[1]:
+            assert after[key] != servers[1]
+        else:
+            assert after[key] == before[key]
+
+
+def test_set_many_writes_each_key_to_its_shard(cache, servers):
+    data = {key: key.upper() for key in KEYS[:300]}
+    assert cache.set_many(data, timeout=60) == []
+
+    ring = HashRing(servers)
+    shard_keys = get_shard_keys(servers)
+    for server in servers:
+        expected = {key for key in data if servers[ring.get_index(cache.make_key(key))] == server}
+        assert expected
+        assert shard_keys[server] == expected
+
+
+def test_get_many_merges_the_shards(cache):
+    data = {key: {'value': key} for key in KEYS[:300]}
+    # Written one at a time so that the bulk read is checked against single key placement
+    for key, value in data.items():
+        cache.set(key, value, timeout=60)
+
+    assert cache.get_many([*data, 'missing']) == data
+
+
+def test_get_many_of_one_shard(cache, servers):
+    ring = HashRing(servers)
+    keys = [key for key in KEYS if ring.get_index(cache.make_key(key)) == 0][:10]
+    cache.set_many({key: key for key in keys}, timeout=60)
+
+    assert cache.get_many(keys) == {key: key for key in keys}
+
+
+def test_delete_many_deletes_from_every_shard(cache, servers):
+    data = {key: key for key in KEYS[:300]}
+    cache.set_many(data, timeout=60)
+    cache.delete_many(KEYS[:200])
+
+    assert cache.get_many(data) == {key: key for key in KEYS[200:300]}
+    shard_keys = get_shard_keys(servers)
+    assert set().union(*shard_keys.values()) == set(KEYS[200:300])
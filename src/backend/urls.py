@@ -15,6 +15,7 @@ from backend.settings.base import (
     STATIC_URL,
     DjangoSettings,
 )
+from backend.views import cache_metrics, queue_metrics_stream
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -27,7 +28,10 @@ urlpatterns = [
     path('api/schema/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
 
-    path('django-rq/', include('django_rq.urls'))
+    path('django-rq/', include('django_rq.urls')),
+
+    path('metrics/cache/<str:token>', cache_metrics, name='cache-metrics'),
+    path('metrics/queues/stream', queue_metrics_stream, name='queue-metrics-stream'),
 ]
 
 if APP_MODE == DjangoSettings.LOCAL:
@@ -0,0 +1,73 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.defaults import page_not_found, permission_denied
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from backend.settings.base import METRICS_API_TOKEN
+from services.queue_metrics import QueueSampler, get_collector, get_queues
+
+
+def cache_metrics(request: HttpRequest, token: str) -> HttpResponse:
+    """
+        Cache metrics in prometheus text format. Metrics are per process so
+        this shows the gunicorn worker that served the request, labeled by pid.
+    """
+    if not METRICS_API_TOKEN or not constant_time_compare(token, METRICS_API_TOKEN):
+        return permission_denied(request, 'You don’t have permission to access this page')
+
+    metrics = cache.get_metrics() if hasattr(cache, 'get_metrics') else None
+    if metrics is None:
+        return page_not_found(request, 'Cache metrics are not enabled')
+
+    return HttpResponse(metrics.to_prometheus(), content_type='text/plain; version=0.0.4')
+
+
+async def _get_user(request: HttpRequest):
+    """ The user of the session, or else of the JWT in the Authorization header """
+    user = await request.auser()
+    if user.is_authenticated:
+        return user
+    try:
+        auth = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed:
+        return None
+    return auth[0] if auth else None
+
+
+async def queue_metrics_stream(request: HttpRequest) -> HttpResponse:
+    """
+        Server-sent events of live queue metrics for staff users. The first
+        event has every queue, later events only the queues that changed.
+        Streams only when served through backend.asgi, under WSGI each open
+        stream would hold a worker for as long as the client stays connected,
+        so the metrics are returned once as json without the rates.
+    """
+    user = await _get_user(request)
+    if user is None or not user.is_staff:
+        return permission_denied(request, 'You don’t have permission to access this page')
+
+    if not isinstance(request, ASGIRequest):
+        sampler = QueueSampler(get_queues())
+        return JsonResponse(await sync_to_async(sampler.sample)())
+
+    collector = get_collector()
+
+    async def events():
+        async for metrics in collector.subscribe():
+            if metrics is None:
+                yield ': keepalive\n\n'
+            else:
+                yield f'event: metrics\ndata: {json.dumps(metrics)}\n\n'
+
+    return StreamingHttpResponse(
+        events(),
+        content_type='text/event-stream',
+        # X-Accel-Buffering stops nginx from buffering the stream
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
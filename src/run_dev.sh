@@ -35,6 +35,10 @@ fi
 
 if [[ $1 == 'rq-worker' ]]; then
     echo "Running rq worker"
-    python3 manage.py rqworker default
+    # The queues of RQ_QUEUES in priority order, from rq_queues in the config file
+    RQ_QUEUE_NAMES=$(python3 manage.py shell -c "from django.conf import settings; print(' '.join(settings.RQ_QUEUES))")
+    echo "Run script: RQ queues = $RQ_QUEUE_NAMES"
+    # The scheduler runs the delayed jobs of queue.enqueue_in, like check_email_outbox
+    python3 manage.py rqworker --with-scheduler $RQ_QUEUE_NAMES
 fi
 
@@ -0,0 +1,49 @@
+"""
+    Load test of cache reads from async code, comparing the thread hop that
+    django uses when a backend has no async methods (sync_to_async around the
+    sync method) against the native redis.asyncio methods of RedisCache.
+    Needs the redis server configured in CACHES.
+    Run from the src directory with:
+    python manage.py runscript bench_cache_async --script-args 50 200
+    where 50 is the number of concurrent tasks and 200 the reads per task.
+"""
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+KEY = 'bench:async'
+
+
+async def thread_hop_get():
+    return await sync_to_async(cache.get)(KEY)
+
+
+async def native_get():
+    return await cache.aget(KEY)
+
+
+async def measure(name, func, concurrency, reads):
+    async def worker():
+        for _ in range(reads):
+            await func()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    print(f'{name:<14}{concurrency * reads / elapsed:>14.0f}')
+
+
+async def main(concurrency, reads):
+    await cache.aset(KEY, {'session': 'x' * 200}, 300)
+    print(f'{"path":<14}{"reads/s":>14}')
+    await measure('thread hop', thread_hop_get, concurrency, reads)
+    await measure('native async', native_get, concurrency, reads)
+    await cache.adelete(KEY)
+
+
+def run(*args):
+    concurrency = int(args[0]) if args else 50
+    reads = int(args[1]) if len(args) > 1 else 200
+    asyncio.run(main(concurrency, reads))
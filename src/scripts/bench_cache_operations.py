@@ -0,0 +1,114 @@
+"""
+    Compares round trips and latency of the cache operations in
+    backend.settings.redis against how they were done before they were
+    pipelined. Needs the redis server configured in CACHES.
+    Run from the src directory with:
+    python manage.py runscript bench_cache_operations
+"""
+import time
+
+from django.conf import settings
+from redis.connection import Connection
+
+from backend.settings.redis import RedisCacheClient
+
+ITERATIONS = 500
+KEYS = [f'bench:ops:{i}' for i in range(50)]
+
+
+class CountingConnection(Connection):
+    """ Every packed send is one round trip, pipelines included """
+    round_trips = 0
+
+    def send_packed_command(self, command, check_health=True):
+        CountingConnection.round_trips += 1
+        return super().send_packed_command(command, check_health)
+
+
+def legacy_add_zero_timeout(cache, key, value):
+    client = cache.get_client(key, write=True)
+    if ret := bool(client.set(key, cache._serializer.dumps(value), nx=True)):
+        client.delete(key)
+    return ret
+
+
+def legacy_incr(cache, key, delta):
+    client = cache.get_client(key, write=True)
+    if not client.exists(key):
+        raise ValueError(f"Key '{key}' not found.")
+    return client.incr(key, delta)
+
+
+def legacy_set_many(cache, data, timeout):
+    pipeline = cache.get_client(None, write=True).pipeline()
+    pipeline.mset({k: cache._serializer.dumps(v) for k, v in data.items()})
+    for key in data:
+        pipeline.expire(key, timeout)
+    pipeline.execute()
+
+
+def legacy_incr_many(cache, data):
+    return {key: legacy_incr(cache, key, delta) for key, delta in data.items()}
+
+
+def legacy_touch_many(cache, keys, timeout):
+    return {key: cache.touch(key, timeout) for key in keys}
+
+
+def legacy_get_or_set_many(cache, data, timeout):
+    # What django's get_or_set() does for each key
+    ret = {}
+    for key, default in data.items():
+        value = cache.get(key, None)
+        if value is None:
+            cache.add(key, default, timeout)
+            value = cache.get(key, default)
+        ret[key] = value
+    return ret
+
+
+def measure(name, func, iterations):
+    CountingConnection.round_trips = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    print(
+        f'{name:<30}{CountingConnection.round_trips / iterations:>12.1f}'
+        f'{elapsed / iterations * 1000:>14.3f}'
+    )
+
+
+def run(*args):
+    iterations = int(args[0]) if args else ITERATIONS
+    options = dict(settings.CACHES['default'].get('OPTIONS', {}))
+    options['connection_class'] = CountingConnection
+    cache = RedisCacheClient(settings.CACHES['default']['LOCATION'].split(';'), **options)
+
+    data = {key: {'value': i} for i, key in enumerate(KEYS)}
+    counters = {key: 1 for key in KEYS}
+
+    print(f'{"operation":<30}{"round trips":>12}{"latency (ms)":>14}')
+    measure('add timeout=0 (before)', lambda: legacy_add_zero_timeout(cache, KEYS[0], 1), iterations)
+    measure('add timeout=0 (after)', lambda: cache.add(KEYS[0], 1, 0), iterations)
+
+    cache.set(KEYS[0], 0, 300)
+    measure('incr (before)', lambda: legacy_incr(cache, KEYS[0], 1), iterations)
+    measure('incr (after)', lambda: cache.incr(KEYS[0], 1), iterations)
+
+    measure('set_many x50 (before)', lambda: legacy_set_many(cache, data, 300), iterations)
+    measure('set_many x50 (after)', lambda: cache.set_many(data, 300), iterations)
+
+    cache.set_many(counters, 300)
+    measure('incr_many x50 (before)', lambda: legacy_incr_many(cache, counters), iterations)
+    measure('incr_many x50 (after)', lambda: cache.incr_many(counters), iterations)
+
+    measure('touch_many x50 (before)', lambda: legacy_touch_many(cache, KEYS, 300), iterations)
+    measure('touch_many x50 (after)', lambda: cache.touch_many(KEYS, 300), iterations)
+
+    cache.delete_many(KEYS)
+    measure('get_or_set_many x50 (before)', lambda: legacy_get_or_set_many(cache, counters, 300), iterations)
+    cache.delete_many(KEYS)
+    measure('get_or_set_many x50 (after)', lambda: cache.get_or_set_many(counters, 300), iterations)
+
+    cache.delete_many(KEYS)
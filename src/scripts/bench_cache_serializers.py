@@ -0,0 +1,91 @@
+"""
+    Micro-benchmark of the cache serializers in backend.settings.redis.
+    Compares bytes stored in redis and dumps/loads throughput for payloads
+    similar to what the admin caches. Does not need a running redis.
+    Run from the src directory with:
+    python manage.py runscript bench_cache_serializers
+"""
+import time
+
+from backend.settings.redis import (
+    CompressedSerializer,
+    JSONSerializer,
+    MsgPackSerializer,
+    RedisSerializer,
+)
+
+ITERATIONS = 2000
+
+
+def get_payloads() -> dict:
+    session = {
+        '_auth_user_id': '1',
+        '_auth_user_backend': 'django.contrib.auth.backends.ModelBackend',
+        '_auth_user_hash': 'c1b0d2f0b7a9e6f5d4c3b2a1908f7e6d5c4b3a29180f7e6d5c4b3a2918f7e6d5',
+    }
+    now = time.time()
+    throttle_history = [now - i * 0.75 for i in range(60)]
+    listview = {
+        'count': 100,
+        'results': [
+            {
+                'pk': i,
+                'name': f'Product {i}',
+                'description': 'Lorem ipsum dolor sit amet, consectetur adipiscing elit.',
+                'price': 19.99 + i,
+                'is_active': i % 2 == 0,
+                'created_at': '2024-12-01T10:00:00+00:00',
+                'tags': ['blue', 'red'],
+            }
+            for i in range(100)
+        ],
+    }
+    return {
+        'session': session,
+        'throttle_history': throttle_history,
+        'listview': listview,
+    }
+
+
+def get_serializers() -> dict:
+    serializers = {
+        'json': RedisSerializer(),
+        'fast-json': JSONSerializer(),
+        'fast-json+zlib': CompressedSerializer(JSONSerializer(), 'zlib', 1024),
+    }
+    try:
+        serializers['msgpack'] = MsgPackSerializer()
+        serializers['msgpack+zlib'] = CompressedSerializer(MsgPackSerializer(), 'zlib', 1024)
+    except Exception as e:
+        print(f'Skipping msgpack: {e}')
+    try:
+        serializers['msgpack+lz4'] = CompressedSerializer(MsgPackSerializer(), 'lz4', 1024)
+    except Exception as e:
+        print(f'Skipping lz4: {e}')
+    return serializers
+
+
+def run(*args):
+    iterations = int(args[0]) if args else ITERATIONS
+    payloads = get_payloads()
+    serializers = get_serializers()
+
+    print(f'{"payload":<18}{"serializer":<16}{"bytes":>8}{"dumps/s":>12}{"loads/s":>12}')
+    for payload_name, payload in payloads.items():
+        for serializer_name, serializer in serializers.items():
+            data = serializer.dumps(payload)
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                serializer.dumps(payload)
+            dumps_per_sec = iterations / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                serializer.loads(data)
+            loads_per_sec = iterations / (time.perf_counter() - start)
+
+            print(
+                f'{payload_name:<18}{serializer_name:<16}{len(data):>8}'
+                f'{dumps_per_sec:>12.0f}{loads_per_sec:>12.0f}'
+            )
@@ -0,0 +1,103 @@
+"""
+    Measures email throughput against a local stub of the SMTP2GO send api,
+    comparing one blocking request per email with
+    services.email_service.dispatch_payloads. The stub answers after a delay
+    and fails a share of the requests with 429 or 503 to exercise retries.
+    No email is sent.
+    Run from the src directory with:
+    python manage.py runscript bench_email_dispatch --script-args <emails> <delay ms> <failure rate>
+    e.g. python manage.py runscript bench_email_dispatch --script-args 500 50 0.05
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from services.email_service import dispatch_payloads
+
+
+class StubEmailApiHandler(BaseHTTPRequestHandler):
+    delay = 0.05
+    failure_rate = 0.0
+    requests = 0
+
+    def do_POST(self):
+        StubEmailApiHandler.requests += 1
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(self.delay)
+
+        if random.random() < self.failure_rate:
+            status, body = random.choice([429, 503]), {'data': {'error': 'Try again later'}}
+        else:
+            recipients = len(payload.get('to', [])) + len(payload.get('bcc', []))
+            status, body = 200, {'data': {'succeeded': recipients, 'failed': 0}}
+
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubEmailApiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def build_payload(i: int) -> dict:
+    return {
+        'to': [f'user{i}@example.com'],
+        'sender': 'noreply@example.com',
+        'subject': 'Reset your password',
+        'html_body': f'<p>Reset link {i}</p>',
+        'api_key': 'stub',
+    }
+
+
+def send_blocking(api_url: str, payloads: list[dict]) -> int:
+    # The previous way, a new connection and a blocking request per email
+    sent = 0
+    for payload in payloads:
+        response = httpx.post(api_url, json=payload, timeout=10)
+        sent += response.status_code == 200
+    return sent
+
+
+def measure(name: str, func, count: int) -> None:
+    StubEmailApiHandler.requests = 0
+    start = time.perf_counter()
+    sent = func()
+    elapsed = time.perf_counter() - start
+    print(f'{name:<32}{sent:>8}{StubEmailApiHandler.requests:>10}{count / elapsed:>12.1f}')
+
+
+def run(*args):
+    count = int(args[0]) if args else 500
+    StubEmailApiHandler.delay = (float(args[1]) if len(args) > 1 else 50) / 1000
+    StubEmailApiHandler.failure_rate = float(args[2]) if len(args) > 2 else 0.05
+
+    server = start_stub_server()
+    api_url = f'http://127.0.0.1:{server.server_port}/v3/email/send'
+    payloads = [build_payload(i) for i in range(count)]
+
+    print(f'{"method":<32}{"sent":>8}{"requests":>10}{"emails/s":>12}')
+    try:
+        blocking_count = min(count, 100)
+        measure('blocking, one per email', lambda: send_blocking(api_url, payloads[:blocking_count]), blocking_count)
+        for rate_limit in (0, 50):
+            measure(f'dispatch_payloads, limit {rate_limit or "none"}', lambda: asyncio.run(dispatch_payloads(
+                payloads, api_url=api_url, rate_limit=rate_limit, concurrency=20
+            ))['sent'], count)
+    finally:
+        server.shutdown()
@@ -0,0 +1,44 @@
+"""
+    Compares rendering reset password emails with render_to_string against
+    services.email_renderer.
+    Run from the src directory with:
+    python manage.py runscript bench_email_render --script-args 10000
+"""
+import time
+
+from django.template.loader import render_to_string
+
+from backend.settings.base import BRAND_NAME
+from services.email_renderer import renderer
+
+TEMPLATE_NAME = 'email/reset-password.html'
+
+
+def build_contexts(count: int) -> list[dict]:
+    return [
+        {'firstname': f'User {i}', 'link': f'https://example.com/reset-password/{i}/token-{i}'}
+        for i in range(count)
+    ]
+
+
+def measure(name: str, func, count: int) -> list[str]:
+    start = time.perf_counter()
+    emails = func()
+    elapsed = time.perf_counter() - start
+    print(f'{name:<28}{elapsed:>10.3f}s{count / elapsed:>14.0f}')
+    return emails
+
+
+def run(*args):
+    count = int(args[0]) if args else 10000
+    contexts = build_contexts(count)
+
+    print(f'{"method":<28}{"time":>11}{"emails/s":>14}')
+    expected = measure('render_to_string', lambda: [
+        render_to_string(TEMPLATE_NAME, {**context, 'brand_name': BRAND_NAME}) for context in contexts
+    ], count)
+    measure('renderer.render', lambda: [renderer.render(TEMPLATE_NAME, context) for context in contexts], count)
+    emails = measure('renderer.render_many', lambda: renderer.render_many(TEMPLATE_NAME, contexts), count)
+
+    if emails != expected:
+        print('Rendered emails differ from render_to_string')
@@ -0,0 +1,49 @@
+"""
+    Compares jobs per second enqueued one at a time against
+    services.queue_service.enqueue_many, with and without deduplication.
+    Enqueues to a separate 'bench-enqueue' queue on the default RQ connection
+    that no worker listens to and empties it afterwards. Use a local redis.
+    Run from the src directory with:
+    python manage.py runscript bench_enqueue --script-args 100000
+"""
+import time
+
+import django_rq
+from rq import Queue
+
+from services.queue_service import enqueue_many_to_queue
+
+QUEUE_NAME = 'bench-enqueue'
+
+
+def enqueue_one_by_one(queue: Queue, count: int) -> int:
+    # The previous way, one round trip per job
+    for i in range(count):
+        queue.enqueue('builtins.len', (i,))
+    return count
+
+
+def measure(name: str, queue: Queue, func, count: int) -> None:
+    start = time.perf_counter()
+    enqueued = func()
+    elapsed = time.perf_counter() - start
+    print(f'{name:<36}{enqueued:>10}{enqueued / elapsed:>14.0f}')
+    queue.empty()
+
+
+def run(*args):
+    count = int(args[0]) if args else 100000
+    queue = Queue(QUEUE_NAME, connection=django_rq.get_connection('default'))
+    args_list = [((i,),) for i in range(count)]
+
+    print(f'{"method":<36}{"jobs":>10}{"jobs/s":>14}')
+    try:
+        measure('enqueue per job', queue, lambda: enqueue_one_by_one(queue, min(count, 10000)), count)
+        measure('enqueue_many', queue, lambda: enqueue_many_to_queue(
+            queue, 'builtins.len', args_list
+        )['enqueued'], count)
+        measure('enqueue_many with job_key', queue, lambda: enqueue_many_to_queue(
+            queue, 'builtins.len', args_list, job_key=lambda value: f'bench-enqueue-{value[0]}'
+        )['enqueued'], count)
+    finally:
+        queue.empty()
@@ -0,0 +1,75 @@
+"""
+    Compares fetching failed jobs one Job.fetch at a time against the batched
+    iter_queue_failed_jobs. Creates failed jobs in a separate 'bench-failed'
+    queue on the default RQ connection and deletes them afterwards.
+    Use a local redis.
+    Run from the src directory with:
+    python manage.py runscript bench_failed_jobs --script-args 50000
+"""
+import time
+
+import django_rq
+from rq import Queue
+from rq.job import Job
+from rq.registry import FailedJobRegistry
+from rq.results import Result
+from rq.utils import now
+
+from services.queue_service import build_job_dict, iter_queue_failed_jobs
+
+QUEUE_NAME = 'bench-failed'
+
+
+def create_failed_jobs(queue: Queue, count: int) -> None:
+    registry = FailedJobRegistry(queue=queue)
+    for start in range(0, count, 1000):
+        with queue.connection.pipeline() as pipeline:
+            for i in range(start, min(start + 1000, count)):
+                job = Job.create(
+                    'builtins.print', args=(i,), id=f'bench-failed-{i}', origin=queue.name,
+                    connection=queue.connection,
+                )
+                job.ended_at = now()
+                exc_string = f'Traceback (most recent call last):\nValueError: bench job {i} failed'
+                # What a worker stores when a job fails
+                Result.create_failure(job, ttl=3600, exc_string=exc_string, pipeline=pipeline)
+                registry.add(job, ttl=3600, exc_string=exc_string, pipeline=pipeline)
+            pipeline.execute()
+
+
+def legacy_get_failed_jobs(queue: Queue) -> list[dict]:
+    # The previous implementation, one round trip per job
+    registry = FailedJobRegistry(queue=queue)
+    jobs = []
+    for id in registry.get_job_ids():
+        jobs.append(build_job_dict(Job.fetch(id, connection=queue.connection)))
+    return jobs
+
+
+def measure(name: str, func) -> None:
+    start = time.perf_counter()
+    count = len(func())
+    print(f'{name:<36}{count:>8}{time.perf_counter() - start:>12.3f}s')
+
+
+def run(*args):
+    count = int(args[0]) if args else 50000
+    queue = Queue(QUEUE_NAME, connection=django_rq.get_connection('default'))
+
+    print(f'Creating {count} failed jobs')
+    create_failed_jobs(queue, count)
+    try:
+        print(f'{"method":<36}{"jobs":>8}{"time":>13}')
+        measure('Job.fetch per job (all)', lambda: legacy_get_failed_jobs(queue))
+        measure('batched (all)', lambda: list(iter_queue_failed_jobs(queue)))
+        measure('batched (page of 100, newest first)', lambda: list(
+            iter_queue_failed_jobs(queue, offset=100, limit=100, newest_first=True)
+        ))
+    finally:
+        registry = FailedJobRegistry(queue=queue)
+        for start in range(0, count, 1000):
+            with queue.connection.pipeline() as pipeline:
+                for i in range(start, min(start + 1000, count)):
+                    pipeline.delete(Job.key_for(f'bench-failed-{i}'), Result.get_key(f'bench-failed-{i}'))
+                pipeline.execute()
+        queue.connection.delete(registry.key)
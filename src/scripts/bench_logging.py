@@ -0,0 +1,67 @@
+"""
+    Compares log calls that format their context into an f-string with log
+    calls that pass a LoggerContext as extra, at a level that is filtered
+    out and at one that is written with the text and json formatters.
+    Records are written to an in memory stream.
+    Run from the src directory with:
+    python manage.py runscript bench_logging --script-args 100000
+"""
+import io
+import logging
+import time
+
+from backend.settings.logging import (
+    JSONFormatter,
+    LoggerContext,
+    RequestContextFilter,
+    TextFormatter,
+)
+
+TEXT_FORMAT = '{asctime} {levelname} [{name}:{lineno}] {message}'
+
+
+def build_logger(formatter: logging.Formatter) -> logging.Logger:
+    logger = logging.getLogger('bench_logging')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.handlers.clear()
+    handler = logging.StreamHandler(io.StringIO())
+    handler.setFormatter(formatter)
+    handler.addFilter(RequestContextFilter())
+    logger.addHandler(handler)
+    return logger
+
+
+def measure(name: str, func, count: int):
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    elapsed = time.perf_counter() - start
+    print(f'{name:<36}{elapsed:>10.3f}s{count / elapsed:>14.0f}')
+
+
+def run(*args):
+    count = int(args[0]) if args else 100000
+    context = {'subject': 'Reset password', 'to': ['user@example.com'], 'response': 'ok'}
+
+    def eager(logger: logging.Logger, level: int):
+        def log(i):
+            log_ctx = LoggerContext(type='EMAIL_SUCCESS', context=context)
+            logger.log(level, f'Email api successful with response: {log_ctx.__dict__}')
+        return log
+
+    def lazy(logger: logging.Logger, level: int):
+        def log(i):
+            logger.log(level, 'Email api successful with response',
+                       extra=LoggerContext(type='EMAIL_SUCCESS', context=context))
+        return log
+
+    text_logger = build_logger(TextFormatter(TEXT_FORMAT, style='{', datefmt='%Y-%m-%dT%H:%M:%S%z'))
+    print(f'{"method":<36}{"time":>11}{"calls/s":>14}')
+    measure('filtered, f-string', eager(text_logger, logging.DEBUG), count)
+    measure('filtered, extra', lazy(text_logger, logging.DEBUG), count)
+    measure('emitted text, f-string', eager(text_logger, logging.INFO), count)
+    measure('emitted text, extra', lazy(text_logger, logging.INFO), count)
+
+    json_logger = build_logger(JSONFormatter())
+    measure('emitted json, extra', lazy(json_logger, logging.INFO), count)
@@ -0,0 +1,88 @@
+"""
+    Compares generating presigned urls of private files with a new boto3
+    client per url against the cached client and urls of
+    backend.settings.storage_backend. S3 is replaced by moto, which needs
+    to be installed and use_local_s3 set to true in config.toml.
+    Run from the src directory with:
+    python manage.py runscript bench_presigned_urls --script-args 100 50
+"""
+import time
+
+import boto3
+
+from backend.settings.base import ENV
+
+try:
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+
+def measure(name: str, func, count: int, rounds: int):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f'{name:<28}{elapsed / rounds * 1000:>12.3f}ms{count * rounds / elapsed:>12.0f}')
+
+
+def run(*args):
+    if mock_aws is None:
+        print('moto is required, install it with: pip install moto')
+        return
+    if not ENV.application.use_local_s3:
+        print('Set use_local_s3 to true in config.toml')
+        return
+
+    from backend.settings import storage_backend
+
+    count = int(args[0]) if args else 100
+    rounds = int(args[1]) if len(args) > 1 else 50
+
+    with mock_aws():
+        storage = storage_backend.PrivateS3Boto3Storage()
+        s3_client = storage_backend.s3_clients.get_client()
+        if storage_backend.region and storage_backend.region != 'us-east-1':
+            s3_client.create_bucket(
+                Bucket=storage.bucket_name,
+                CreateBucketConfiguration={'LocationConstraint': storage_backend.region}
+            )
+        else:
+            s3_client.create_bucket(Bucket=storage.bucket_name)
+
+        names = [f'private/bench-{i}.pdf' for i in range(count)]
+        for name in names:
+            s3_client.put_object(Bucket=storage.bucket_name, Key=f'media/{name}', Body=b'bench')
+
+        def new_client_per_url():
+            for name in names:
+                boto3.client(
+                    's3',
+                    aws_access_key_id = storage_backend.access_key,
+                    aws_secret_access_key = storage_backend.secret_key,
+                    region_name = storage_backend.region
+                ).generate_presigned_url(
+                    'get_object',
+                    Params={'Bucket': storage.bucket_name, 'Key': f'media/{name}'},
+                    ExpiresIn=storage_backend.URL_EXPIRES_IN
+                )
+
+        def cached_client():
+            storage_backend.presigned_urls.clear()
+            for name in names:
+                storage.url(name)
+
+        def bulk_url_cold():
+            storage_backend.presigned_urls.clear()
+            storage.bulk_url(names)
+
+        print(f'{"method":<28}{"per page":>14}{"urls/s":>12}')
+        measure('new client per url', new_client_per_url, count, rounds)
+        measure('cached client, url', cached_client, count, rounds)
+        measure('bulk_url, uncached', bulk_url_cold, count, rounds)
+        measure('bulk_url, cached', lambda: storage.bulk_url(names), count, rounds)
+
+        url = storage.url(names[0])
+        if storage.bucket_name not in url or f'media/{names[0]}' not in url:
+            print(f'Unexpected presigned url: {url}')
+        storage_backend.presigned_urls.clear()
@@ -0,0 +1,46 @@
+"""
+    Compares the latency of getting queue stats through the HTTP call to our
+    own /django-rq/stats.json endpoint against computing them in process with
+    services.queue_service.get_queue_stats. Needs the app served at DOMAIN.
+    Run from the src directory with:
+    python manage.py runscript bench_queue_stats --script-args 200
+"""
+import statistics
+import time
+
+import httpx
+from django_rq.queues import get_queue_by_index
+from django_rq.settings import QUEUES_LIST
+
+from backend.settings.base import DOMAIN, PROTOCOL, RQ_API_TOKEN
+from services.queue_service import get_queue_list, get_queue_stats
+
+
+def self_http_stats() -> list[dict]:
+    # The previous implementation of get_queue_list
+    response = httpx.get(f'{PROTOCOL}://{DOMAIN}/django-rq/stats.json/{RQ_API_TOKEN}')
+    return response.json().get('queues')
+
+
+def in_process_stats() -> list[dict]:
+    return [get_queue_stats(get_queue_by_index(index)) for index in range(len(QUEUES_LIST))]
+
+
+def measure(name: str, func, iterations: int) -> None:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f'{name:<28}{statistics.mean(timings):>10.3f}{statistics.median(timings):>10.3f}{p95:>10.3f}')
+
+
+def run(*args):
+    iterations = int(args[0]) if args else 200
+
+    print(f'{"method":<28}{"avg ms":>10}{"p50 ms":>10}{"p95 ms":>10}')
+    measure('self HTTP call', self_http_stats, iterations)
+    measure('in process', in_process_stats, iterations)
+    measure('get_queue_list (cached)', get_queue_list, iterations)
@@ -0,0 +1,26 @@
+"""
+    Deletes the keys of the default cache without touching other data in the
+    same redis db such as RQ queues. Keys are deleted in batches so it can run
+    while the app is serving requests, preferably off-peak.
+    Run from the src directory with:
+    python manage.py runscript clear_cache --script-args 1000 0.05
+    where 1000 is the number of keys per batch and 0.05 the seconds to pause
+    between batches.
+"""
+import time
+
+from django.core.cache import cache
+
+
+def run(*args):
+    batch_size = int(args[0]) if args else 1000
+    pause = float(args[1]) if len(args) > 1 else 0.05
+
+    start = time.perf_counter()
+
+    def progress(deleted: int):
+        print(f'Deleted {deleted} keys in {time.perf_counter() - start:.1f}s')
+
+    print(f'Clearing cache in batches of {batch_size} keys with {pause}s pause')
+    deleted = cache.clear(batch_size=batch_size, pause=pause, progress=progress)
+    print(f'Done. Deleted {deleted} keys in {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,86 @@
+"""
+    Load tests an endpoint, e.g. a listview, with a new database connection
+    per request (CONN_MAX_AGE = 0) and then with the configured connection
+    reuse. Requests are made in process with the django test client, one
+    thread per concurrent client, authenticated as the first superuser.
+    When pool is enabled both runs use the pool; disable it to measure
+    connections without reuse.
+    Run from the src directory with:
+    python manage.py runscript load_test_db_connections --script-args <path> 1000 8
+"""
+import math
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.db import connection, connections
+from django.test import Client
+from rest_framework_simplejwt.tokens import AccessToken
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    """ values must be sorted """
+    return values[max(math.ceil(len(values) * percent / 100) - 1, 0)]
+
+
+def load_test(path: str, headers: dict, requests: int, concurrency: int) -> tuple[float, list[float], int]:
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client_thread(count: int):
+        client = Client(headers=headers)
+        thread_latencies = []
+        thread_errors = 0
+        for _ in range(count):
+            start = time.perf_counter()
+            response = client.get(path)
+            thread_latencies.append(time.perf_counter() - start)
+            thread_errors += response.status_code >= 400
+        # Each thread has its own connection
+        connection.close()
+        with lock:
+            latencies.extend(thread_latencies)
+            errors.append(thread_errors)
+
+    threads = [
+        threading.Thread(target=client_thread, args=(requests // concurrency + (i < requests % concurrency),))
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, sorted(latencies), sum(errors)
+
+
+def run(*args):
+    if not args:
+        print('Usage: --script-args <path> [requests] [concurrency]')
+        return
+    path = args[0]
+    requests = int(args[1]) if len(args) > 1 else 1000
+    concurrency = int(args[2]) if len(args) > 2 else 8
+
+    user = get_user_model().objects.filter(is_superuser=True, is_active=True).first()
+    if user is None:
+        print('A superuser is required')
+        return
+    headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+
+    settings_dict = connections.settings['default']
+    conn_max_age = settings_dict['CONN_MAX_AGE']
+    if 'pool' in settings_dict.get('OPTIONS', {}):
+        print('pool is enabled, both runs use it')
+    connection.close()
+
+    print(f'{"connections":<28}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"errors":>8}')
+    for name, max_age in (('new per request', 0), (f'CONN_MAX_AGE = {conn_max_age}', conn_max_age)):
+        settings_dict['CONN_MAX_AGE'] = max_age
+        elapsed, latencies, errors = load_test(path, headers, requests, concurrency)
+        print(
+            f'{name:<28}{len(latencies) / elapsed:>10.0f}'
+            f'{_percentile(latencies, 50) * 1000:>10.2f}{_percentile(latencies, 99) * 1000:>10.2f}{errors:>8}'
+        )
+    settings_dict['CONN_MAX_AGE'] = conn_max_age
@@ -1,25 +1,197 @@
-import json
+import hashlib
+import logging
+import threading
+import time
 
 import httpx
+from django.core.cache import cache
 
 from backend.settings.base import (
+    CLOUDFLARE_TURNSTILE_ALLOW_WHEN_UNAVAILABLE,
     CLOUDFLARE_TURNSTILE_SECRET_KEY,
+    CLOUDFLARE_TURNSTILE_VERIFY_TIMEOUT,
     CLOUDFLARE_TURNSTILE_VERIFY_URL,
 )
+from backend.settings.logging import LoggerContext
 from django_admin.utils import get_client_ip
+from services import http_client
 
+log = logging.getLogger(__name__)
 
-def verify_token(request, token: str) -> bool:
-    payload = json.dumps({
+# Seconds a verified token can pass once more for the same client ip.
+# Turnstile tokens expire after 300 seconds and can only be verified once,
+# so a double submit of the same token would otherwise fail.
+VERIFIED_TOKEN_TIMEOUT = 300
+
+# Consecutive failed calls to Turnstile after which verification fails fast
+BREAKER_FAILURE_THRESHOLD = 5
+
+# Seconds verification fails fast before one call is let through to try again
+BREAKER_RESET_TIMEOUT = 30
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._is_trial_running = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._is_trial_running or time.monotonic() - self._opened_at < self._reset_timeout:
+                return False
+            self._is_trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._is_trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._is_trial_running or self._failures >= self._failure_threshold:
+                self._opened_at = time.monotonic()
+            self._is_trial_running = False
+
+
+breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+
+
+def _get_cache_key(token: str, client_ip: str) -> str:
+    return f'turnstile:{hashlib.sha256(f"{client_ip}:{token}".encode()).hexdigest()}'
+
+
+def _build_payload(request, token: str) -> dict:
+    return {
         'secret': CLOUDFLARE_TURNSTILE_SECRET_KEY,
         'response': token,
         'remoteip': get_client_ip(request)
-    })
+    }
+
+
+def _on_cache_error(e: Exception) -> None:
+    log_ctx = LoggerContext(type='GENERAL_ERROR', context={'error': str(e)})
+    log.warning('Turnstile pass cache unavailable, verifying with Turnstile', extra=log_ctx)
+
+
+def _use_cached_pass(cache_key: str) -> bool:
+    """ The pass is deleted so that it is used only once """
+    try:
+        return bool(cache.delete(cache_key))
+    except Exception as e:
+        _on_cache_error(e)
+        return False
+
+
+async def _ause_cached_pass(cache_key: str) -> bool:
+    try:
+        return bool(await cache.adelete(cache_key))
+    except Exception as e:
+        _on_cache_error(e)
+        return False
+
+
+def _cache_pass(cache_key: str) -> None:
+    try:
+        _cache_pass(cache_key)
+    except Exception as e:
+        _on_cache_error(e)
+
+
+async def _acache_pass(cache_key: str) -> None:
+    try:
+        await _acache_pass(cache_key)
+    except Exception as e:
+        _on_cache_error(e)
+
+
+def _on_unavailable(error: str) -> bool:
+    log_ctx = LoggerContext(type='GENERAL_ERROR', context={'error': error})
+    log.error('Turnstile verification unavailable', extra=log_ctx)
+    return CLOUDFLARE_TURNSTILE_ALLOW_WHEN_UNAVAILABLE
+
+
+def _handle_response(response: httpx.Response) -> bool | None:
+    """ Whether the token is valid, None when Turnstile failed """
+    if response.status_code >= 500:
+        breaker.record_failure()
+        return None
+    breaker.record_success()
+    try:
+        return bool(response.json().get('success'))
+    except (ValueError, AttributeError):
+        return False
+
+
+def verify_token(request, token: str) -> bool:
+    if not token:
+        return False
+    payload = _build_payload(request, token)
+    cache_key = _get_cache_key(token, payload['remoteip'])
+    if _use_cached_pass(cache_key):
+        return True
+    if not breaker.allow_request():
+        return _on_unavailable('Circuit breaker is open')
+
+    try:
+        response = http_client.request(
+            'POST',
+            CLOUDFLARE_TURNSTILE_VERIFY_URL,
+            json=payload,
+            timeout=CLOUDFLARE_TURNSTILE_VERIFY_TIMEOUT,
+        )
+    except httpx.HTTPError as e:
+        breaker.record_failure()
+        return _on_unavailable(str(e))
+    except Exception:
+        # Also ends a trial call so that the breaker does not stay open
+        breaker.record_failure()
+        raise
+
+    is_valid = _handle_response(response)
+    if is_valid is None:
+        return _on_unavailable(f'Turnstile responded with {response.status_code}')
+    if is_valid:
+        _cache_pass(cache_key)
+    return is_valid
+
+
+async def averify_token(request, token: str) -> bool:
+    if not token:
+        return False
+    payload = _build_payload(request, token)
+    cache_key = _get_cache_key(token, payload['remoteip'])
+    if await _ause_cached_pass(cache_key):
+        return True
+    if not breaker.allow_request():
+        return _on_unavailable('Circuit breaker is open')
 
-    response = httpx.post(
-        CLOUDFLARE_TURNSTILE_VERIFY_URL, 
-        data=payload, 
-        headers={'Content-Type': 'application/json'}
-    ).json()
+    try:
+        response = await http_client.arequest(
+            'POST',
+            CLOUDFLARE_TURNSTILE_VERIFY_URL,
+            json=payload,
+            timeout=CLOUDFLARE_TURNSTILE_VERIFY_TIMEOUT,
+        )
+    except httpx.HTTPError as e:
+        breaker.record_failure()
+        return _on_unavailable(str(e))
+    except Exception:
+        # Also ends a trial call so that the breaker does not stay open
+        breaker.record_failure()
+        raise
 
-    return response.get('success')
+    is_valid = _handle_response(response)
+    if is_valid is None:
+        return _on_unavailable(f'Turnstile responded with {response.status_code}')
+    if is_valid:
+        await _acache_pass(cache_key)
+    return is_valid
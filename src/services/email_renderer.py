@@ -0,0 +1,84 @@
+"""
+    Renders the email templates in templates/email. Compiled templates and
+    the header and footer of each brand are kept in memory, so rendering an
+    email only renders the parts that depend on its context.
+"""
+import threading
+from typing import Iterable
+
+from django.conf import settings
+from django.template import Context, TemplateDoesNotExist, engines
+from django.template.base import Template
+from django.utils.safestring import SafeString, mark_safe
+
+from backend.settings.base import BRAND_NAME
+
+# Partials that only depend on the brand, by the context variable
+# base-email.html reads them from
+BRAND_PARTIALS = {
+    'email_header': 'email/email-header.html',
+    'email_footer': 'email/email-footer.html',
+}
+
+
+class EmailRenderer:
+    def __init__(self, engine=None):
+        self._engine = engine
+        self._templates = {}
+        self._partials = {}
+        self._lock = threading.Lock()
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = engines['django'].engine
+        return self._engine
+
+    def get_template(self, template_name: str) -> Template:
+        # Not kept when DEBUG so that edited templates show up
+        if settings.DEBUG:
+            return self.engine.get_template(template_name)
+
+        template = self._templates.get(template_name)
+        if template is None:
+            with self._lock:
+                template = self._templates.get(template_name)
+                if template is None:
+                    template = self._templates[template_name] = self.engine.get_template(template_name)
+        return template
+
+    def get_partials(self, brand_name: str) -> dict[str, SafeString]:
+        partials = self._partials.get(brand_name)
+        if partials is None or settings.DEBUG:
+            context = Context({'brand_name': brand_name})
+            partials = {}
+            for name, template_name in BRAND_PARTIALS.items():
+                try:
+                    partials[name] = mark_safe(self.get_template(template_name).render(context))
+                except TemplateDoesNotExist:
+                    # base-email.html falls back to including it
+                    continue
+            self._partials[brand_name] = partials
+        return partials
+
+    def render_many(self,
+                    template_name: str,
+                    contexts: Iterable[dict],
+                    brand_name: str = BRAND_NAME) -> list[str]:
+        """
+            Renders a template once per context, each pushed onto one Context
+            that holds the brand name and partials.
+        """
+        template = self.get_template(template_name)
+        context = Context({'brand_name': brand_name, **self.get_partials(brand_name)})
+        ret = []
+        for template_context in contexts:
+            with context.push(template_context):
+                ret.append(template.render(context))
+        return ret
+
+    def render(self, template_name: str, template_context: dict, brand_name: str = BRAND_NAME) -> str:
+        return self.render_many(template_name, [template_context], brand_name)[0]
+
+
+renderer = EmailRenderer()
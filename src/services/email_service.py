@@ -1,21 +1,90 @@
+import asyncio
+import json
 import logging
+import random
+import time
+from datetime import timedelta
 from typing import Any, List
 
+import django_rq
 import httpx
-from django.template.loader import render_to_string
+from redis.exceptions import LockError
 
 from backend.settings.base import (
     APP_MODE,
-    BRAND_NAME,
     DEFAULT_EMAIL_SENDER,
+    RQ_QUEUES,
     SMTP_API_KEY,
     SMTP_API_URL,
+    SMTP_CONCURRENCY,
+    SMTP_MAX_RETRIES,
+    SMTP_RATE_LIMIT,
     DjangoSettings,
 )
 from backend.settings.logging import LoggerContext
+from services.email_renderer import renderer
+from services.http_client import clients
 
 log = logging.getLogger(__name__)
 
+# Emails are sent by a job on this queue
+EMAIL_QUEUE = 'high' if 'high' in RQ_QUEUES else 'default'
+
+# Redis list of the json messages waiting to be sent
+OUTBOX_KEY = 'email:outbox'
+
+# Set while a drain job is queued so that a burst of emails enqueues one job.
+# Expires in case the job is lost.
+DRAIN_SCHEDULED_KEY = 'email:outbox:scheduled'
+DRAIN_SCHEDULED_TTL = 600
+
+# Seconds after a drain job is queued that check_email_outbox runs, after
+# DRAIN_SCHEDULED_KEY of a lost job has expired
+DRAIN_CHECK_DELAY = DRAIN_SCHEDULED_TTL + 60
+
+# Number of messages taken from the outbox at a time
+DRAIN_BATCH_SIZE = 500
+
+# Redis list of the messages taken by the drain job and not yet sent. They are
+# put back in the outbox by the next drain job if the job dies before sending them.
+PROCESSING_KEY = 'email:outbox:processing'
+
+# Held by the running drain job so that only one job uses PROCESSING_KEY.
+# Renewed for every batch and expires if the job dies.
+DRAIN_LOCK_KEY = 'email:outbox:lock'
+DRAIN_LOCK_TTL = 600
+
+# Max recipients SMTP2GO accepts in each of to, cc and bcc
+MAX_RECIPIENTS_PER_REQUEST = 100
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30
+
+
+class TokenBucket:
+    """ Allows rate acquisitions per second on average and bursts of up to capacity """
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
 def send_email(to: List[str],
                subject: str,
                email_template: str,
@@ -23,8 +92,12 @@ def send_email(to: List[str],
                cc: List[str] = [],
                bcc: List[str] = [],
                attachments: List[Any] | None = None,
-               override_sender_email: str | None = None) -> None:
+               override_sender_email: str | None = None,
+               batch: bool = False) -> None:
     """
+        Queues an email. It is rendered and sent by a job on EMAIL_QUEUE so
+        that the request does not wait for the email api. The template context
+        and attachments must be json serializable.
         @param to: A list of email recipients as string
         @param subject: The string subject of the email
         @param email_template: The string path of the email template to be used
@@ -32,73 +105,285 @@ def send_email(to: List[str],
         @param cc: The list of email recipients as string to be cc'ed
         @param bcc: The list of email recipients as string to be bcc'ed
         @param attachments: The list of attachments to be sent
-        @param override_sender_email: The optional string email to be used as the sender of the 
+        @param override_sender_email: The optional string email to be used as the sender of the
            email. If not provided, default email sender is used
+        @param batch: Whether this email may be merged with identical emails into one
+           api request, with all their recipients in bcc
     """
     if APP_MODE == DjangoSettings.TEST:
         return
 
-    # Default email sender
-    sender: str = DEFAULT_EMAIL_SENDER
+    message = {
+        'to': to,
+        'subject': subject,
+        'email_template': email_template,
+        'template_context': template_context,
+        'cc': cc,
+        'bcc': bcc,
+        'attachments': attachments,
+        'sender': override_sender_email or DEFAULT_EMAIL_SENDER,
+        'batch': batch,
+    }
+    connection = django_rq.get_connection(EMAIL_QUEUE)
+    connection.rpush(OUTBOX_KEY, json.dumps(message))
+    schedule_drain(connection)
 
-    # Assign brand name
-    template_context['brand_name'] = BRAND_NAME
 
-    try:
-        data = {
-            'to': to,
-            'sender': sender,
-            'subject': subject,
-            'html_body': render_to_string(email_template, template_context),
+def schedule_drain(connection) -> bool:
+    """
+        Enqueues a drain job unless one is already queued, and a check that
+        the emails were sent in case the job is lost. Needs a worker started
+        with --with-scheduler. Returns whether a job was enqueued.
+    """
+    if not connection.set(DRAIN_SCHEDULED_KEY, 1, nx=True, ex=DRAIN_SCHEDULED_TTL):
+        return False
+
+    queue = django_rq.get_queue(EMAIL_QUEUE)
+    queue.enqueue(drain_email_outbox)
+    queue.enqueue_in(timedelta(seconds=DRAIN_CHECK_DELAY), check_email_outbox)
+    return True
+
+
+def render_messages(messages: list[dict]) -> list[str | None]:
+    """
+        Renders the html body of each message, None for those that failed.
+        Messages of the same template are rendered together.
+    """
+    by_template = {}
+    for index, message in enumerate(messages):
+        by_template.setdefault(message['email_template'], []).append(index)
+
+    html_bodies = [None] * len(messages)
+    for template_name, indexes in by_template.items():
+        try:
+            rendered = renderer.render_many(template_name, [messages[i]['template_context'] for i in indexes])
+        except Exception:
+            # Render one at a time to only leave out the messages that fail
+            rendered = []
+            for i in indexes:
+                try:
+                    rendered.append(renderer.render(template_name, messages[i]['template_context']))
+                except Exception as e:
+                    context = {'subject': messages[i]['subject'], 'to': messages[i]['to'], 'exception': str(e)}
+                    log_ctx = LoggerContext(type='EMAIL_ERROR', context=context)
+                    log.error('Email error encountered', extra=log_ctx)
+                    rendered.append(None)
+        for i, html_body in zip(indexes, rendered):
+            html_bodies[i] = html_body
+    return html_bodies
+
+
+def build_payloads(messages: list[dict]) -> list[dict]:
+    """
+        Renders messages into email api request bodies. Batch messages with
+        the same sender, subject and body are merged, MAX_RECIPIENTS_PER_REQUEST
+        bcc recipients at a time.
+    """
+    payloads = []
+    batches = {}
+    for message, html_body in zip(messages, render_messages(messages)):
+        if html_body is None:
+            continue
+
+        payload = {
+            'to': message['to'],
+            'sender': message['sender'],
+            'subject': message['subject'],
+            'html_body': html_body,
             'api_key': SMTP_API_KEY,
         }
+        if message['batch'] and not message['cc'] and not message['attachments']:
+            key = (payload['sender'], payload['subject'], payload['html_body'])
+            batches.setdefault(key, []).extend([*message['to'], *message['bcc']])
+            continue
 
-        if cc:
-            data['cc'] = cc
+        if message['cc']:
+            payload['cc'] = message['cc']
+        if message['bcc']:
+            payload['bcc'] = message['bcc']
+        if message['attachments']:
+            payload['attachments'] = message['attachments']
+        payloads.append(payload)
 
-        if bcc:
-            data['bcc'] = bcc
+    for (sender, subject, html_body), recipients in batches.items():
+        recipients = list(dict.fromkeys(recipients))
+        for start in range(0, len(recipients), MAX_RECIPIENTS_PER_REQUEST):
+            payloads.append({
+                'to': [sender],
+                'bcc': recipients[start:start + MAX_RECIPIENTS_PER_REQUEST],
+                'sender': sender,
+                'subject': subject,
+                'html_body': html_body,
+                'api_key': SMTP_API_KEY,
+            })
+    return payloads
 
-        if attachments:
-            data['attachments'] = attachments
 
-        if override_sender_email:
-            data['sender'] = override_sender_email
+def _get_retry_delay(attempt: int, retry_after: str | None) -> float:
+    """ Exponential backoff with full jitter, at least what Retry-After asks for """
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, min(int(retry_after), RETRY_MAX_DELAY))
+    return delay
 
-        response = httpx.post(
-            SMTP_API_URL, 
-            json=data, 
-            headers={'Content-type': 'application/json'},
-            timeout=10
-        )
 
-        response_data = response.json()
+async def _post_email(client: httpx.AsyncClient,
+                      bucket: TokenBucket,
+                      api_url: str,
+                      payload: dict,
+                      max_retries: int) -> bool:
+    context = {
+        'subject': payload['subject'],
+        'to': payload['to'],
+        'cc': payload.get('cc', []),
+        'bcc': payload.get('bcc', []),
+    }
+    for attempt in range(max_retries + 1):
+        await bucket.acquire()
+        retry_after = None
+        try:
+            response = await client.post(api_url, json=payload)
+        except httpx.HTTPError as e:
+            context['exception'] = str(e)
+        else:
+            try:
+                response_data = response.json()
+            except ValueError:
+                response_data = {'data': response.text}
 
-        context = {
-            'subject': subject,
-            'to': to,
-            'cc': cc,
-            'bcc': bcc
-        }
+            if response.status_code == 200:
+                # Errors of earlier attempts
+                context.pop('error', None)
+                context.pop('exception', None)
+                context['response'] = str(response_data.get('data'))
+                log_ctx = LoggerContext(type='EMAIL_SUCCESS', context=context)
+                log.info('Email api successful with response', extra=log_ctx)
+                return True
 
-        if response.status_code != 200:
             context['error'] = str(response_data.get('data'))
-            log_ctx = LoggerContext(
-                type='EMAIL_ERROR',
-                context=context
-            )
-            log.error(f'Error encountered with email api: {log_ctx.__dict__}')
-        else:
-            context['response'] = str(response_data.get('data'))
-            log_ctx = LoggerContext(
-                type='EMAIL_SUCCESS',
-                context=context
-            )
-            log.info(f'Email api successful with response: {log_ctx.__dict__}')
-    except Exception as e:
-        context['exception'] = str(e)
-        log_ctx = LoggerContext(
-            type='EMAIL_ERROR',
-            context=context
-        )
-        log.error(f'Email error encountered: {log_ctx.__dict__}')
+            if response.status_code not in RETRY_STATUS_CODES:
+                break
+            retry_after = response.headers.get('Retry-After')
+
+        if attempt < max_retries:
+            await asyncio.sleep(_get_retry_delay(attempt, retry_after))
+
+    context['attempts'] = attempt + 1
+    log_ctx = LoggerContext(type='EMAIL_ERROR', context=context)
+    log.error('Error encountered with email api', extra=log_ctx)
+    return False
+
+
+async def dispatch_payloads(payloads: list[dict],
+                            api_url: str = SMTP_API_URL,
+                            rate_limit: float = SMTP_RATE_LIMIT,
+                            concurrency: int = SMTP_CONCURRENCY,
+                            max_retries: int = SMTP_MAX_RETRIES,
+                            client: httpx.AsyncClient | None = None,
+                            bucket: TokenBucket | None = None) -> dict:
+    """
+        Sends email api requests concurrently over the pooled connections of
+        services.http_client, at most concurrency at a time.
+        Returns {'sent': count, 'failed': count}
+    """
+    bucket = bucket or TokenBucket(rate_limit)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def post(client: httpx.AsyncClient, payload: dict) -> bool:
+        async with semaphore:
+            try:
+                return await _post_email(client, bucket, api_url, payload, max_retries)
+            except Exception as e:
+                # Counted as failed so that the other payloads are still sent
+                context = {'subject': payload['subject'], 'to': payload['to'], 'exception': str(e)}
+                log_ctx = LoggerContext(type='EMAIL_ERROR', context=context)
+                log.exception('Error encountered with email api', extra=log_ctx)
+                return False
+
+    async def post_all(client: httpx.AsyncClient) -> list[bool]:
+        return await asyncio.gather(*(post(client, payload) for payload in payloads))
+
+    results = await post_all(client or clients.get_async_client(api_url))
+    sent = sum(results)
+    return {'sent': sent, 'failed': len(results) - sent}
+
+
+def _take_batch(connection) -> list[bytes]:
+    """ Moves up to DRAIN_BATCH_SIZE messages from the outbox to PROCESSING_KEY """
+    with connection.pipeline(transaction=False) as pipeline:
+        for _ in range(DRAIN_BATCH_SIZE):
+            pipeline.lmove(OUTBOX_KEY, PROCESSING_KEY, 'LEFT', 'RIGHT')
+        return [raw_message for raw_message in pipeline.execute() if raw_message is not None]
+
+
+def _restore_processing(connection) -> int:
+    """ Puts the messages of a drain job that died back at the front of the outbox, in order """
+    restored = 0
+    while connection.lmove(PROCESSING_KEY, OUTBOX_KEY, 'RIGHT', 'LEFT') is not None:
+        restored += 1
+    return restored
+
+
+async def _drain_outbox(connection, lock) -> dict:
+    summary = {'sent': 0, 'failed': 0}
+    bucket = TokenBucket(SMTP_RATE_LIMIT)
+    try:
+        while raw_messages := _take_batch(connection):
+            payloads = build_payloads([json.loads(raw_message) for raw_message in raw_messages])
+            result = await dispatch_payloads(payloads, bucket=bucket)
+            # The batch is sent, failed payloads are logged by dispatch_payloads
+            connection.delete(PROCESSING_KEY)
+            lock.reacquire()
+            summary['sent'] += result['sent']
+            summary['failed'] += result['failed']
+    finally:
+        # The event loop of the clients ends with the job
+        await clients.aclose()
+    return summary
+
+
+def drain_email_outbox() -> None:
+    """
+        RQ job that sends the queued emails until the outbox is empty.
+        Emails queued after the job started either get taken by it or
+        schedule the next job. A batch stays in PROCESSING_KEY until it is
+        sent, so the batch of a job that dies is sent by the next job.
+    """
+    start = time.perf_counter()
+    connection = django_rq.get_connection(EMAIL_QUEUE)
+    connection.delete(DRAIN_SCHEDULED_KEY)
+    lock = connection.lock(DRAIN_LOCK_KEY, timeout=DRAIN_LOCK_TTL)
+    if not lock.acquire(blocking=False):
+        # The running job takes the emails this job was queued for
+        return
+
+    try:
+        summary = {'restored': _restore_processing(connection)}
+        summary.update(asyncio.run(_drain_outbox(connection, lock)))
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            # Expired because a batch took longer than DRAIN_LOCK_TTL
+            pass
+
+    # Emails queued while the lock was held whose job found it taken
+    if connection.llen(OUTBOX_KEY):
+        schedule_drain(connection)
+
+    log_ctx = LoggerContext(type='GENERAL_INFO', context=summary, duration=time.perf_counter() - start)
+    log.info('Email outbox drained', extra=log_ctx)
+
+
+def check_email_outbox() -> None:
+    """
+        RQ job scheduled with every drain job. Schedules another drain job if
+        emails are left because the drain job was lost or its worker was killed,
+        and checks again later while a drain job is still queued.
+    """
+    connection = django_rq.get_connection(EMAIL_QUEUE)
+    if not connection.llen(OUTBOX_KEY) and not connection.llen(PROCESSING_KEY):
+        return
+
+    if not schedule_drain(connection):
+        django_rq.get_queue(EMAIL_QUEUE).enqueue_in(timedelta(seconds=DRAIN_CHECK_DELAY), check_email_outbox)
@@ -0,0 +1,185 @@
+"""
+    Shared clients for outbound requests to integrations. Each host gets its
+    own pool of keep-alive connections, configured by [integration.http] in
+    config.toml. Pools are recreated in a process forked after they were
+    created, e.g. gunicorn workers of a preloaded app or RQ work horses,
+    so that processes never share a socket.
+"""
+import asyncio
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+from weakref import WeakKeyDictionary
+
+import httpx
+from django.core.exceptions import ImproperlyConfigured
+
+from backend.settings.base import INTEGRATION_HTTP_OPTIONS
+from backend.settings.cache_metrics import LATENCY_BUCKETS, Histogram
+from backend.settings.tracing import record
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+
+def get_host(url: str) -> str:
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    return f'{parts.scheme}://{parts.hostname}:{port}'
+
+
+class HostStats:
+    """ Latency until response headers of the requests to each host """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def observe(self, host: str, seconds: float, is_error: bool):
+        with self._lock:
+            stats = self._hosts.get(host)
+            if stats is None:
+                stats = self._hosts[host] = {'latency': Histogram(LATENCY_BUCKETS), 'errors': 0}
+            stats['latency'].observe(seconds)
+            stats['errors'] += is_error
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                host: {
+                    'requests': stats['latency'].count,
+                    'errors': stats['errors'],
+                    'avg_ms': round(stats['latency'].sum / stats['latency'].count * 1000, 3),
+                    'buckets': stats['latency'].get_cumulative_counts(),
+                }
+                for host, stats in self._hosts.items()
+            }
+
+
+class TimedTransport(httpx.HTTPTransport):
+    def __init__(self, stats: HostStats, **kwargs):
+        super().__init__(**kwargs)
+        self._stats = stats
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        is_error = True
+        try:
+            response = super().handle_request(request)
+            is_error = response.status_code >= 500
+            return response
+        finally:
+            seconds = time.perf_counter() - start
+            self._stats.observe(get_host(str(request.url)), seconds, is_error)
+            record('http', seconds)
+
+
+class TimedAsyncTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, stats: HostStats, **kwargs):
+        super().__init__(**kwargs)
+        self._stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        is_error = True
+        try:
+            response = await super().handle_async_request(request)
+            is_error = response.status_code >= 500
+            return response
+        finally:
+            seconds = time.perf_counter() - start
+            self._stats.observe(get_host(str(request.url)), seconds, is_error)
+            record('http', seconds)
+
+
+class HttpClients:
+    def __init__(self,
+                 timeout: float = 10,
+                 connect_timeout: float = 5,
+                 max_connections: int = 20,
+                 max_keepalive_connections: int = 10,
+                 keepalive_expiry: float = 30,
+                 retries: int = 2,
+                 http2: bool = False):
+        if http2 and h2 is None:
+            raise ImproperlyConfigured('h2 is required to use http2 for integrations')
+
+        self._timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._transport_options = {'limits': self._limits, 'retries': retries, 'http2': http2}
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self.stats = HostStats()
+        self._clients = {}
+        # Async clients are bound to the event loop they were created in
+        self._async_clients = WeakKeyDictionary()
+
+    def _check_fork(self):
+        # Inherited pools are dropped without being closed since their
+        # sockets are still used by the parent
+        if self._pid != os.getpid():
+            self._reset()
+
+    def get_client(self, url: str) -> httpx.Client:
+        host = get_host(url)
+        with self._lock:
+            self._check_fork()
+            client = self._clients.get(host)
+            if client is None:
+                client = self._clients[host] = httpx.Client(
+                    timeout=self._timeout,
+                    transport=TimedTransport(self.stats, **self._transport_options),
+                )
+            return client
+
+    def get_async_client(self, url: str) -> httpx.AsyncClient:
+        host = get_host(url)
+        with self._lock:
+            self._check_fork()
+            clients = self._async_clients.setdefault(asyncio.get_running_loop(), {})
+            client = clients.get(host)
+            if client is None:
+                client = clients[host] = httpx.AsyncClient(
+                    timeout=self._timeout,
+                    transport=TimedAsyncTransport(self.stats, **self._transport_options),
+                )
+            return client
+
+    def close(self):
+        with self._lock:
+            self._check_fork()
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            client.close()
+
+    async def aclose(self):
+        """ Closes the async clients of the running event loop """
+        with self._lock:
+            self._check_fork()
+            clients = self._async_clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client.aclose()
+
+
+clients = HttpClients(**INTEGRATION_HTTP_OPTIONS)
+
+
+def request(method: str, url: str, **kwargs) -> httpx.Response:
+    return clients.get_client(url).request(method, url, **kwargs)
+
+
+async def arequest(method: str, url: str, **kwargs) -> httpx.Response:
+    return await clients.get_async_client(url).request(method, url, **kwargs)
+
+
+def get_host_stats() -> dict:
+    return clients.stats.get_stats()
@@ -0,0 +1,218 @@
+"""
+    Live metrics of the RQ queues for the queue dashboard. One collector per
+    event loop, so per process under an ASGI server, samples Redis every
+    SAMPLE_INTERVAL seconds while at least one client is subscribed and fans
+    each sample out to all of them, so the number of open dashboards does not
+    change the number of Redis reads.
+"""
+import asyncio
+import logging
+import math
+import time
+from typing import AsyncIterator
+from weakref import WeakKeyDictionary
+
+from asgiref.sync import sync_to_async
+from django_rq.queues import get_queue_by_index
+from django_rq.settings import QUEUES_LIST
+from rq import Queue
+from rq.job import Job
+from rq.utils import as_text, current_timestamp, utcparse
+from rq.worker import WorkerStatus
+from rq.worker_registration import WORKERS_BY_QUEUE_KEY
+
+from backend.settings.logging import LoggerContext
+
+log = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = 2
+
+# Number of the most recently finished jobs that duration percentiles are computed from
+DURATION_SAMPLE_SIZE = 100
+
+# Seconds without a new sample after which subscribers get a keepalive
+KEEPALIVE_INTERVAL = 15
+
+
+def _percentile(values: list[float], percent: float) -> float | None:
+    """ values must be sorted """
+    if not values:
+        return None
+    return round(values[max(math.ceil(len(values) * percent / 100) - 1, 0)], 3)
+
+
+def _per_second(count: float | None, seconds: float | None) -> float | None:
+    if count is None or not seconds:
+        return None
+    return round(max(count, 0) / seconds, 2)
+
+
+class QueueSampler:
+    """
+        Reads the metrics of queues with two pipelined round trips per queue.
+        Rates are estimated from the difference with the previous sample:
+        - completed and failed are the entries added to the finished and
+          failed registries since then, found by their scores. Jobs kept
+          forever (result_ttl=-1) all have the score +inf and are counted
+          by the change in their number instead.
+        - dequeued is completed + failed + the change in started jobs
+        - enqueued is dequeued + the change in queue depth
+    """
+    def __init__(self, queues: list[Queue]):
+        self.queues = queues
+        # Registry key -> (highest finite score, number of +inf scores) in the previous sample
+        self._watermarks = {}
+        # Queue name -> (time, depth, started)
+        self._previous = {}
+
+    def sample(self) -> dict:
+        return {
+            'timestamp': time.time(),
+            'queues': {queue.name: self._sample_queue(queue) for queue in self.queues},
+        }
+
+    def _sample_queue(self, queue: Queue) -> dict:
+        connection = queue.connection
+        now = current_timestamp()
+        finished_key = queue.finished_job_registry.key
+        failed_key = queue.failed_job_registry.key
+        with connection.pipeline(transaction=False) as pipeline:
+            pipeline.llen(queue.key)
+            pipeline.zcount(queue.started_job_registry.key, f'({now}', '+inf')
+            pipeline.smembers(WORKERS_BY_QUEUE_KEY % queue.name)
+            for key in (finished_key, failed_key):
+                watermark, _ = self._watermarks.get(key, ('+inf', 0))
+                pipeline.zcount(key, f'({watermark}', '(+inf')
+                pipeline.zcount(key, '+inf', '+inf')
+                pipeline.zrevrangebyscore(key, '(+inf', '-inf', start=0, num=1, withscores=True)
+            pipeline.zrevrange(finished_key, 0, DURATION_SAMPLE_SIZE - 1, withscores=True)
+            depth, started, worker_keys, *registries, finished_jobs = pipeline.execute()
+        sampled_at = time.monotonic()
+
+        with connection.pipeline(transaction=False) as pipeline:
+            for worker_key in worker_keys:
+                pipeline.hget(worker_key, 'state')
+            for job_id, _ in finished_jobs:
+                pipeline.hmget(Job.key_for(as_text(job_id)), 'started_at', 'ended_at')
+            results = pipeline.execute()
+        states = [as_text(state) for state in results[:len(worker_keys)] if state is not None]
+
+        durations = []
+        for started_at, ended_at in results[len(worker_keys):]:
+            if started_at and ended_at:
+                durations.append((utcparse(as_text(ended_at)) - utcparse(as_text(started_at))).total_seconds())
+        durations.sort()
+
+        is_first_sample = finished_key not in self._watermarks
+        counts = []
+        for key, (added, kept, last) in ((finished_key, registries[:3]), (failed_key, registries[3:])):
+            watermark, previous_kept = self._watermarks.get(key, (0, kept))
+            counts.append(added + kept - previous_kept)
+            self._watermarks[key] = (last[0][1] if last else watermark, kept)
+        completed, failed = (None, None) if is_first_sample else counts
+
+        seconds = dequeued = enqueued = None
+        if queue.name in self._previous and completed is not None:
+            previous_time, previous_depth, previous_started = self._previous[queue.name]
+            seconds = sampled_at - previous_time
+            dequeued = completed + failed + started - previous_started
+            enqueued = dequeued + depth - previous_depth
+        self._previous[queue.name] = (sampled_at, depth, started)
+
+        busy = states.count(WorkerStatus.BUSY.value)
+        return {
+            'depth': depth,
+            'started_jobs': started,
+            'workers': len(states),
+            'busy_workers': busy,
+            'busy_ratio': round(busy / len(states), 3) if states else None,
+            'enqueued_per_sec': _per_second(enqueued, seconds),
+            'dequeued_per_sec': _per_second(dequeued, seconds),
+            'completed_per_sec': _per_second(completed, seconds),
+            'failed_per_sec': _per_second(failed, seconds),
+            'duration_p50': _percentile(durations, 50),
+            'duration_p95': _percentile(durations, 95),
+            'duration_p99': _percentile(durations, 99),
+        }
+
+
+def get_queues() -> list[Queue]:
+    return [get_queue_by_index(index) for index in range(len(QUEUES_LIST))]
+
+
+class QueueMetricsCollector:
+    """ Must be created in the event loop it is used in, see get_collector """
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self._interval = interval
+        self._snapshot = None
+        self._version = 0
+        self._subscribers = 0
+        self._changed = asyncio.Condition()
+        self._task = None
+
+    async def _run(self):
+        # A new sampler so that rates are not computed across idle periods
+        sampler = QueueSampler(get_queues())
+        # Redis is read in a thread so that the event loop is never blocked
+        sample = sync_to_async(sampler.sample, thread_sensitive=False)
+        while self._subscribers:
+            try:
+                snapshot = await sample()
+            except Exception as e:
+                log_ctx = LoggerContext(type='GENERAL_ERROR', context={'error': str(e)})
+                log.error('Failed to sample queue metrics', extra=log_ctx)
+            else:
+                async with self._changed:
+                    self._snapshot = snapshot
+                    self._version += 1
+                    self._changed.notify_all()
+            await asyncio.sleep(self._interval)
+        self._task = None
+
+    async def subscribe(self) -> AsyncIterator[dict | None]:
+        """
+            Yields the metrics of every queue first, then of only the queues
+            whose metrics changed. Yields None when there was no new sample
+            for KEEPALIVE_INTERVAL seconds.
+        """
+        self._subscribers += 1
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+        version = 0
+        sent = {}
+        try:
+            while True:
+                async with self._changed:
+                    try:
+                        await asyncio.wait_for(
+                            self._changed.wait_for(lambda: self._version > version), KEEPALIVE_INTERVAL
+                        )
+                    except TimeoutError:
+                        snapshot = None
+                    else:
+                        version = self._version
+                        snapshot = self._snapshot
+
+                if snapshot is None:
+                    yield None
+                    continue
+
+                changed = {name: metrics for name, metrics in snapshot['queues'].items() if sent.get(name) != metrics}
+                if changed:
+                    sent.update(changed)
+                    yield {'timestamp': snapshot['timestamp'], 'queues': changed}
+        finally:
+            self._subscribers -= 1
+
+
+# asyncio conditions and tasks are bound to the event loop they are used in
+_collectors = WeakKeyDictionary()
+
+
+def get_collector() -> QueueMetricsCollector:
+    """ The collector of the running event loop """
+    loop = asyncio.get_running_loop()
+    if loop not in _collectors:
+        _collectors[loop] = QueueMetricsCollector()
+    return _collectors[loop]
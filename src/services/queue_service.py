@@ -1,22 +1,62 @@
 import logging
-from typing import Any, Callable
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator
 
 import django_rq
-import httpx
+from django_rq.queues import get_queue_by_index
+from django_rq.settings import QUEUES_LIST
+from django_rq.templatetags.django_rq import to_localtime
 from rq import Queue
-from rq.job import Job
+from rq.executions import ExecutionRegistry
+from rq.group import Group
+from rq.job import Job, JobStatus
 from rq.registry import FailedJobRegistry
+from rq.results import Result
+from rq.scheduler import RQScheduler
+from rq.utils import as_text, current_timestamp, utcparse
+from rq.worker_registration import WORKERS_BY_QUEUE_KEY
 
-from backend.settings.base import (
-    APP_MODE,
-    DOMAIN,
-    PROTOCOL,
-    RQ_API_TOKEN,
-    DjangoSettings,
-)
+from backend.settings.base import APP_MODE, DjangoSettings
 
 log = logging.getLogger(__name__)
 
+# Number of job hashes fetched per round trip when listing jobs
+JOB_FETCH_BATCH_SIZE = 500
+
+# Number of jobs requeued or deleted per pipeline
+JOB_BULK_CHUNK_SIZE = 1000
+
+# Statuses of jobs that enqueue_many does not enqueue again
+PENDING_JOB_STATUSES = {
+    JobStatus.QUEUED.value,
+    JobStatus.DEFERRED.value,
+    JobStatus.SCHEDULED.value,
+    JobStatus.STARTED.value,
+}
+
+# Seconds that get_queue_list reuses the queue stats it computed
+QUEUE_STATS_CACHE_SECONDS = 3
+
+# Returns enqueued_at of the job at the head of a queue, or nil if the queue is empty
+OLDEST_JOB_SCRIPT = """
+local job_id = redis.call('LINDEX', KEYS[1], 0)
+if not job_id then
+    return nil
+end
+return redis.call('HGET', ARGV[1] .. job_id, 'enqueued_at')
+"""
+
+_queue_stats_lock = threading.Lock()
+_queue_stats_cache = {'expires_at': 0, 'queues': []}
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
 
 def build_job_dict(job: Job) -> dict:
     return {
@@ -43,68 +83,375 @@ def enqueue(func: Callable, *args: Any, **kwargs: Any) -> None:
     
     django_rq.enqueue(func, *args, **kwargs)
 
+def enqueue_to(queue_name: str, func: Callable, *args: Any, **kwargs: Any) -> None:
+    """
+        Enqueues task to a queue of RQ_QUEUES, e.g. 'high', 'default' or 'low'.
+    """
+    if APP_MODE == DjangoSettings.TEST:
+        return
 
-def get_queue_list() -> list[dict]:
-    response = httpx.get(f'{PROTOCOL}://{DOMAIN}/django-rq/stats.json/{RQ_API_TOKEN}')
-    data = response.json()
-
-    queues = []
-    for q in data.get('queues'):
-        queue = {'fields': [], 'name': q.get('name')}
-        queue['fields'].append({'label': 'Queued Jobs', 'value': q.get('jobs'), 'field': 'jobs'})
-        queue['fields'].append({'label': 'Oldest Queued Job', 'value': q.get('oldest_job_timestamp'), 'field': 'oldest_job_timestamp'})
-        queue['fields'].append({'label': 'Started Jobs', 'value': q.get('started_jobs'), 'field': 'started_jobs'})
-        queue['fields'].append({'label': 'Workers', 'value': q.get('workers'), 'field': 'workers'})
-        queue['fields'].append({'label': 'Finished Jobs', 'value': q.get('finished_jobs'), 'field': 'finished_jobs'})
-        queue['fields'].append({'label': 'Deferred Jobs', 'value': q.get('deferred_jobs'), 'field': 'deferred_jobs'})
-        queue['fields'].append({'label': 'Failed Jobs', 'value': q.get('failed_jobs'), 'field': 'failed_jobs'})
-        queue['fields'].append({'label': 'Scheduled Jobs', 'value': q.get('scheduled_jobs'), 'field': 'scheduled_jobs'})
-        queue['fields'].append({'label': 'Host', 'value': q.get('connection_kwargs').get('host'), 'field': 'host'})
-        queue['fields'].append({'label': 'Port', 'value': q.get('connection_kwargs').get('port'), 'field': 'port'})
-        queue['fields'].append({'label': 'Scheduler PID', 'value': q.get('scheduler_pid'), 'field': 'scheduler_pid'})
-        
-        queues.append(queue)
-
-    return queues
-
-def get_failed_jobs(queue_name: str) -> list[dict]:
-    queue = django_rq.get_queue()
-    failed_job_registry = FailedJobRegistry(queue=queue)
-    failed_job_ids = failed_job_registry.get_job_ids()
-    redis_conn = django_rq.get_connection(queue_name)
+    django_rq.get_queue(queue_name).enqueue(func, *args, **kwargs)
 
-    jobs = []
-    for id in failed_job_ids:
-        job = Job.fetch(id, connection=redis_conn)
-        obj = build_job_dict(job)
-        jobs.append(obj)
-    
-    return jobs
+def _drop_pending_duplicates(queue: Queue, job_datas: list, seen: set) -> list:
+    """ Leaves out jobs whose id is pending in the queue or was seen before """
+    with queue.connection.pipeline() as pipeline:
+        for job_data in job_datas:
+            pipeline.hget(Job.key_for(job_data.job_id), 'status')
+        statuses = pipeline.execute()
+
+    ret = []
+    for job_data, status in zip(job_datas, statuses):
+        if job_data.job_id in seen or (status is not None and as_text(status) in PENDING_JOB_STATUSES):
+            continue
+        seen.add(job_data.job_id)
+        ret.append(job_data)
+    return ret
+
+def enqueue_many_to_queue(queue: Queue,
+                          func: Callable,
+                          args_list: Iterable[tuple],
+                          job_key: Callable[..., str] | None = None,
+                          chunk_size: int = JOB_BULK_CHUNK_SIZE,
+                          **options: Any) -> dict:
+    """
+        Enqueues a job per args tuple with one pipelined round trip per
+        chunk_size jobs, two when job_key is given.
+        @param job_key: Called with the args of each job. Its result becomes
+            the job id and a job is left out while a job with the same id is
+            queued, deferred, scheduled or started. Two processes enqueueing
+            the same key at the same moment can both enqueue it.
+        @param options: Passed to Queue.prepare_data, e.g. timeout, result_ttl or at_front
+        Returns {'enqueued': count, 'duplicates': count}
+    """
+    summary = {'enqueued': 0, 'duplicates': 0}
+    seen = set()
+    for chunk in _chunks(args_list, chunk_size):
+        job_datas = [
+            Queue.prepare_data(func, args, job_id=job_key(*args) if job_key else None, **options)
+            for args in chunk
+        ]
+        if job_key is not None:
+            job_datas = _drop_pending_duplicates(queue, job_datas, seen)
+        if job_datas:
+            queue.enqueue_many(job_datas)
+        summary['enqueued'] += len(job_datas)
+        summary['duplicates'] += len(chunk) - len(job_datas)
+    return summary
+
+def enqueue_many(func: Callable,
+                 args_list: Iterable[tuple],
+                 queue_name: str = 'default',
+                 job_key: Callable[..., str] | None = None,
+                 **options: Any) -> dict:
+    """
+        Enqueues func once per args tuple to a queue of RQ_QUEUES.
+        See enqueue_many_to_queue.
+    """
+    if APP_MODE == DjangoSettings.TEST:
+        return {'enqueued': 0, 'duplicates': 0}
+
+    summary = enqueue_many_to_queue(django_rq.get_queue(queue_name), func, args_list, job_key, **options)
+    log.info(f'Enqueued {summary["enqueued"]} jobs to queue {queue_name}, {summary["duplicates"]} duplicates')
+    return summary
+
+
+def get_queue_stats(queue: Queue) -> dict:
+    """
+        The stats of /django-rq/stats.json for one queue, read with a single
+        pipelined round trip. Registries are counted without running their
+        cleanup, leaving out entries that have already expired.
+    """
+    connection = queue.connection
+    now = current_timestamp()
+    registries = [
+        queue.started_job_registry,
+        queue.finished_job_registry,
+        queue.deferred_job_registry,
+        queue.failed_job_registry,
+    ]
+    with connection.pipeline(transaction=False) as pipeline:
+        pipeline.llen(queue.key)
+        pipeline.eval(OLDEST_JOB_SCRIPT, 1, queue.key, Job.redis_job_namespace_prefix)
+        pipeline.scard(WORKERS_BY_QUEUE_KEY % queue.name)
+        pipeline.get(RQScheduler.get_locking_key(queue.name))
+        for registry in registries:
+            pipeline.zcount(registry.key, f'({now}', '+inf')
+        # Scores are when the jobs are scheduled, not when they expire
+        pipeline.zcard(queue.scheduled_job_registry.key)
+        jobs, enqueued_at, workers, scheduler_pid, started, finished, deferred, failed, scheduled = pipeline.execute()
+
+    oldest_job_timestamp = '-'
+    if enqueued_at:
+        oldest_job_timestamp = to_localtime(utcparse(as_text(enqueued_at))).strftime('%Y-%m-%d, %H:%M:%S')
+    connection_kwargs = connection.connection_pool.connection_kwargs
+    return {
+        'name': queue.name,
+        'jobs': jobs,
+        'oldest_job_timestamp': oldest_job_timestamp,
+        'started_jobs': started,
+        'workers': workers,
+        'finished_jobs': finished,
+        'deferred_jobs': deferred,
+        'failed_jobs': failed,
+        'scheduled_jobs': scheduled,
+        'connection_kwargs': {'host': connection_kwargs.get('host'), 'port': connection_kwargs.get('port')},
+        'scheduler_pid': int(scheduler_pid) if scheduler_pid is not None else None,
+    }
+
+def get_queue_list(use_cache: bool = True) -> list[dict]:
+    """
+        Stats of every queue in RQ_QUEUES, computed at most once per
+        QUEUE_STATS_CACHE_SECONDS in each process unless use_cache is False.
+    """
+    with _queue_stats_lock:
+        if use_cache and _queue_stats_cache['expires_at'] > time.monotonic():
+            return _queue_stats_cache['queues']
+
+        queues = []
+        for index in range(len(QUEUES_LIST)):
+            q = get_queue_stats(get_queue_by_index(index))
+            queue = {'fields': [], 'name': q.get('name')}
+            queue['fields'].append({'label': 'Queued Jobs', 'value': q.get('jobs'), 'field': 'jobs'})
+            queue['fields'].append({'label': 'Oldest Queued Job', 'value': q.get('oldest_job_timestamp'), 'field': 'oldest_job_timestamp'})
+            queue['fields'].append({'label': 'Started Jobs', 'value': q.get('started_jobs'), 'field': 'started_jobs'})
+            queue['fields'].append({'label': 'Workers', 'value': q.get('workers'), 'field': 'workers'})
+            queue['fields'].append({'label': 'Finished Jobs', 'value': q.get('finished_jobs'), 'field': 'finished_jobs'})
+            queue['fields'].append({'label': 'Deferred Jobs', 'value': q.get('deferred_jobs'), 'field': 'deferred_jobs'})
+            queue['fields'].append({'label': 'Failed Jobs', 'value': q.get('failed_jobs'), 'field': 'failed_jobs'})
+            queue['fields'].append({'label': 'Scheduled Jobs', 'value': q.get('scheduled_jobs'), 'field': 'scheduled_jobs'})
+            queue['fields'].append({'label': 'Host', 'value': q.get('connection_kwargs').get('host'), 'field': 'host'})
+            queue['fields'].append({'label': 'Port', 'value': q.get('connection_kwargs').get('port'), 'field': 'port'})
+            queue['fields'].append({'label': 'Scheduler PID', 'value': q.get('scheduler_pid'), 'field': 'scheduler_pid'})
+
+            queues.append(queue)
+
+        _queue_stats_cache['queues'] = queues
+        _queue_stats_cache['expires_at'] = time.monotonic() + QUEUE_STATS_CACHE_SECONDS
+        return queues
+
+def iter_queue_failed_jobs(queue: Queue,
+                           offset: int = 0,
+                           limit: int | None = None,
+                           newest_first: bool = False,
+                           batch_size: int = JOB_FETCH_BATCH_SIZE) -> Iterator[dict]:
+    """
+        Yields the failed jobs of a queue ordered by failure time. Jobs are
+        fetched batch_size at a time with one pipelined round trip per batch.
+    """
+    registry = FailedJobRegistry(queue=queue)
+    end = None if limit is None else offset + limit
+    start = offset
+    # Expired jobs are only cleaned up from the registry once
+    cleanup = True
+    while end is None or start < end:
+        stop = start + batch_size if end is None else min(start + batch_size, end)
+        job_ids = registry.get_job_ids(start, stop - 1, desc=newest_first, cleanup=cleanup)
+        cleanup = False
+
+        for job in fetch_jobs(job_ids, queue.connection, queue.serializer):
+            yield build_job_dict(job)
+
+        if len(job_ids) < stop - start:
+            break
+        start = stop
+
+def iter_failed_jobs(queue_name: str,
+                     offset: int = 0,
+                     limit: int | None = None,
+                     newest_first: bool = False) -> Iterator[dict]:
+    """
+        Lazily yields failed jobs so that a view can stream them.
+        @param queue_name: The name of the queue in RQ_QUEUES
+        @param offset: The number of jobs to skip
+        @param limit: The max number of jobs to return. All jobs if None
+        @param newest_first: Whether the most recently failed jobs come first
+    """
+    queue = django_rq.get_queue(queue_name)
+    return iter_queue_failed_jobs(queue, offset, limit, newest_first)
+
+def get_failed_jobs(queue_name: str,
+                    offset: int = 0,
+                    limit: int | None = None,
+                    newest_first: bool = False) -> list[dict]:
+    return list(iter_failed_jobs(queue_name, offset, limit, newest_first))
+
+def count_failed_jobs(queue_name: str) -> int:
+    queue = django_rq.get_queue(queue_name)
+    return FailedJobRegistry(queue=queue).count
 
 def get_job(queue_name: str, job_id: str) -> dict:
     redis_conn = django_rq.get_connection(queue_name)
     job = Job.fetch(job_id, connection=redis_conn)
     return build_job_dict(job)
 
-def requeue_jobs(queue_name: str, job_ids: list[str]) -> None:
+def fetch_jobs(job_ids: list[str], connection, serializer=None) -> list[Job]:
+    """
+        Fetches jobs along with their latest result, which is where
+        job.exc_info is read from, in two pipelined round trips instead of
+        one per job. Jobs whose hash no longer exists are left out.
+    """
+    jobs = [
+        job for job in Job.fetch_many(job_ids, connection=connection, serializer=serializer)
+        if job is not None
+    ]
+    with connection.pipeline() as pipeline:
+        for job in jobs:
+            pipeline.xrevrange(Result.get_key(job.id), '+', '-', count=1)
+        results = pipeline.execute()
+
+    for job, result in zip(jobs, results):
+        if result:
+            result_id, payload = result[0]
+            job._cached_result = Result.restore(
+                job.id, as_text(result_id), payload, connection=connection, serializer=serializer
+            )
+    return jobs
+
+def _requeue_registry_jobs(registry: FailedJobRegistry, jobs: list[Job], queues: dict) -> list[str]:
+    """
+        Requeues jobs of a failed job registry with two pipelined round trips.
+        Returns the ids of the jobs requeued. Jobs that are no longer in the
+        registry, e.g. because another request requeued them, are skipped.
+        @param queues: Queues by name, reused across calls
+    """
+    connection = registry.connection
+    # Removing the jobs first claims them so that no job is enqueued twice
+    with connection.pipeline() as pipeline:
+        for job in jobs:
+            pipeline.zrem(registry.key, job.id)
+        removed = pipeline.execute()
+
+    requeued = []
+    with connection.pipeline() as pipeline:
+        for job, is_removed in zip(jobs, removed):
+            if not is_removed:
+                continue
+            queue = queues.get(job.origin)
+            if queue is None:
+                queue = queues[job.origin] = Queue(job.origin, connection=connection, serializer=registry.serializer)
+            # Same as FailedJobRegistry.requeue
+            job.started_at = None
+            job.ended_at = None
+            job._exc_info = ''
+            queue._enqueue_job(job, pipeline=pipeline)
+            requeued.append(job.id)
+        pipeline.execute()
+    return requeued
+
+def requeue_jobs(queue_name: str, job_ids: list[str], chunk_size: int = JOB_BULK_CHUNK_SIZE) -> dict:
+    """
+        Requeues failed jobs chunk_size at a time.
+        Returns {'succeeded': [...], 'missing': [...]} where missing are the
+        ids that are not failed jobs of the queue.
+    """
     redis_conn = django_rq.get_connection(queue_name)
+    queue = Queue(queue_name, connection=redis_conn)
+    registry = queue.failed_job_registry
+    queues = {queue_name: queue}
+
+    summary = {'succeeded': [], 'missing': []}
+    for chunk in _chunks(dict.fromkeys(job_ids), chunk_size):
+        jobs = Job.fetch_many(chunk, connection=redis_conn, serializer=queue.serializer)
+        requeued = _requeue_registry_jobs(registry, [job for job in jobs if job is not None], queues)
+        summary['succeeded'].extend(requeued)
+        requeued = set(requeued)
+        summary['missing'].extend(job_id for job_id in chunk if job_id not in requeued)
+
+    log.info(f'Requeued {len(summary["succeeded"])} jobs for queue {queue_name}, {len(summary["missing"])} missing')
+    return summary
+
+def _get_exc_type(job: Job) -> str:
+    """ The exception class name from the last line of the job's traceback """
+    exc_info = (job.exc_info or '').strip()
+    last_line = exc_info.rsplit('\n', 1)[-1]
+    return last_line.split(':', 1)[0].strip()
 
+def requeue_matching_jobs(queue_name: str,
+                          predicate: Callable[[Job], bool] | None = None,
+                          exc_type: str | None = None,
+                          older_than: timedelta | None = None,
+                          chunk_size: int = JOB_BULK_CHUNK_SIZE) -> dict:
+    """
+        Requeues all failed jobs of a queue that match every given filter.
+        The registry is scanned chunk_size jobs at a time so that it is never
+        loaded whole.
+        @param predicate: Called with each failed job
+        @param exc_type: Exception class name, e.g. 'TimeoutError' or 'httpx.ConnectError'
+        @param older_than: Minimum time since the job failed
+        Returns {'succeeded': [...], 'missing': []}. Jobs matching the
+        filters that another request requeued first are not included.
+    """
+    redis_conn = django_rq.get_connection(queue_name)
     queue = Queue(queue_name, connection=redis_conn)
     registry = queue.failed_job_registry
-    for failed_job_id in registry.get_job_ids():
-        if failed_job_id in job_ids:
-            registry.requeue(failed_job_id)
+    queues = {queue_name: queue}
+    failed_before = None if older_than is None else datetime.now(timezone.utc) - older_than
+
+    def matches(job: Job) -> bool:
+        if failed_before is not None:
+            if job.ended_at is None:
+                return False
+            ended_at = job.ended_at if job.ended_at.tzinfo else job.ended_at.replace(tzinfo=timezone.utc)
+            if ended_at > failed_before:
+                return False
+        if exc_type is not None:
+            job_exc_type = _get_exc_type(job)
+            if job_exc_type != exc_type and not job_exc_type.endswith(f'.{exc_type}'):
+                return False
+        return predicate is None or predicate(job)
+
+    summary = {'succeeded': [], 'missing': []}
+    job_ids = (as_text(job_id) for job_id, _ in redis_conn.zscan_iter(registry.key, count=chunk_size))
+    for chunk in _chunks(job_ids, chunk_size):
+        jobs = fetch_jobs(chunk, redis_conn, queue.serializer)
+        summary['succeeded'].extend(_requeue_registry_jobs(registry, [job for job in jobs if matches(job)], queues))
 
-    log.info(f'Requeued jobs {job_ids} for queue {queue_name}')
+    log.info(f'Requeued {len(summary["succeeded"])} matching jobs for queue {queue_name}')
+    return summary
 
-def delete_jobs(queue_name: str, job_ids: list[str]) -> None:
+def delete_jobs(queue_name: str, job_ids: list[str], chunk_size: int = JOB_BULK_CHUNK_SIZE) -> dict:
+    """
+        Deletes failed jobs with two pipelined round trips per chunk_size jobs,
+        one to read their groups and executions and one to delete them.
+        Returns {'succeeded': [...], 'missing': [...]} where missing are the
+        ids of jobs that did not exist.
+    """
     redis_conn = django_rq.get_connection(queue_name)
     queue = django_rq.get_queue(queue_name)
     failed_job_registry = FailedJobRegistry(queue=queue)
+    started_job_registry = queue.started_job_registry
+
+    summary = {'succeeded': [], 'missing': []}
+    for chunk in _chunks(dict.fromkeys(job_ids), chunk_size):
+        with redis_conn.pipeline(transaction=False) as pipeline:
+            for job_id in chunk:
+                pipeline.hget(Job.key_for(job_id), 'group_id')
+                pipeline.zrange(ExecutionRegistry.key_template.format(job_id), 0, -1)
+            results = pipeline.execute()
+
+        with redis_conn.pipeline() as pipeline:
+            # Index of the commands whose results tell whether the job existed
+            result_indexes = []
+            for index, job_id in enumerate(chunk):
+                group_id, execution_ids = results[index * 2], results[index * 2 + 1]
+                # The keys removed by Job.delete
+                result_indexes.append(len(pipeline))
+                pipeline.zrem(failed_job_registry.key, job_id)
+                pipeline.delete(Job.key_for(job_id))
+                pipeline.lrem(queue.key, 1, job_id)
+                pipeline.delete(Job.dependents_key_for(job_id), f'{Job.redis_job_namespace_prefix}{job_id}:dependencies')
+                if execution_ids:
+                    composite_keys = [f'{job_id}:{as_text(execution_id)}' for execution_id in execution_ids]
+                    pipeline.zrem(started_job_registry.key, *composite_keys)
+                    pipeline.delete(*(f'rq:execution:{composite_key}' for composite_key in composite_keys))
+                pipeline.delete(ExecutionRegistry.key_template.format(job_id))
+                if group_id:
+                    pipeline.srem(f'{Group.REDIS_GROUP_NAME_PREFIX}{as_text(group_id)}', job_id)
+            results = pipeline.execute()
 
-    for job_id in job_ids:
-        job = Job.fetch(job_id, connection=redis_conn)
-        job.delete()
-        failed_job_registry.remove(job_id)
+        for job_id, index in zip(chunk, result_indexes):
+            is_removed, is_deleted = results[index], results[index + 1]
+            summary['succeeded' if is_removed or is_deleted else 'missing'].append(job_id)
 
-    log.info(f'Deleted jobs {job_ids} for queue {queue_name}')
\ No newline at end of file
+    log.info(f'Deleted {len(summary["succeeded"])} jobs for queue {queue_name}, {len(summary["missing"])} missing')
+    return summary